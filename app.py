@@ -1,11 +1,31 @@
-from flask import Flask, request, render_template, jsonify, redirect, url_for, flash
-import sqlite3
+from flask import (
+    Flask,
+    Response,
+    request,
+    render_template,
+    jsonify,
+    redirect,
+    url_for,
+    flash,
+    stream_with_context,
+)
+import json
 import os
-import pandas as pd
+import time
 from werkzeug.utils import secure_filename
-from services.sql_agent import SQLAgent
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+from services.agent_pool import agent_pool
+from services.batch_runner import MAX_QUESTIONS as MAX_BATCH_QUESTIONS, BatchRun
+from services.connection_pool import read_pool
+from services.csv_ingest import convert_csv_to_sqlite
+from services.index_advisor import index_advisor
+from services.ingest_jobs import ingest_jobs
+from services.key_validation import key_validator
+from services.metrics import metrics
+from services.query_budget import cancel_query
+from services.query_cache import nl2sql_cache
+from services.result_cache import result_cache
+from services.schema_cache import schema_cache
+from services.sql_executor import execute_sql
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "your-secret-key-here")
@@ -23,423 +43,21 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def convert_csv_to_sqlite(csv_path, db_path):
-    """將CSV文件轉換為SQLite資料庫"""
-    try:
-        # 嘗試不同的編碼讀取CSV文件
-        encodings = ["utf-8", "big5", "gbk", "latin1", "cp1252"]
-        df = None
-
-        # 先嘗試讀取少量行來檢查文件結構
-        for encoding in encodings:
-            try:
-                # 先讀取前5行來檢查列數和結構
-                sample_df = pd.read_csv(csv_path, encoding=encoding, nrows=5)
-                if not sample_df.empty:
-                    print(
-                        f"成功使用 {encoding} 編碼讀取CSV文件，檢測到 {len(sample_df.columns)} 個欄位"
-                    )
-
-                    # 檢查列數是否過多，如果超過1500列，則採用分片存儲策略
-                    if len(sample_df.columns) > 1500:
-                        print(
-                            f"警告: CSV文件有 {len(sample_df.columns)} 個欄位，超過SQLite建議限制，將採用分片存儲策略"
-                        )
-                        return convert_csv_to_sqlite_chunked(
-                            csv_path, db_path, encoding
-                        )
-                    elif len(sample_df.columns) > 1000:
-                        print(
-                            f"警告: CSV文件有 {len(sample_df.columns)} 個欄位，將進行分批處理"
-                        )
-
-                    # 讀取完整文件，使用分塊讀取避免記憶體問題
-                    # 動態調整chunk_size基於文件大小和列數
-                    file_size = os.path.getsize(csv_path)
-                    if file_size > 30 * 1024 * 1024:  # 大於30MB
-                        chunk_size = 2000 if len(sample_df.columns) > 1000 else 3000
-                    elif file_size > 10 * 1024 * 1024:  # 大於10MB
-                        chunk_size = 3000 if len(sample_df.columns) > 1000 else 5000
-                    else:
-                        chunk_size = 5000 if len(sample_df.columns) > 1000 else 10000
-
-                    print(
-                        f"文件大小: {file_size / (1024 * 1024):.2f}MB，使用chunk_size: {chunk_size}"
-                    )
-                    chunks = []
-
-                    for chunk in pd.read_csv(
-                        csv_path, encoding=encoding, chunksize=chunk_size
-                    ):
-                        if not chunk.empty:
-                            chunks.append(chunk)
-
-                        # 記憶體管理：如果累積的chunks過多，先合併一次
-                        if len(chunks) > 10:
-                            temp_df = pd.concat(chunks, ignore_index=True)
-                            chunks = [temp_df]
-
-                    if chunks:
-                        df = pd.concat(chunks, ignore_index=True)
-                        print(f"成功讀取 {len(df)} 行數據")
-                        break
-
-            except Exception as e:
-                print(f"使用 {encoding} 編碼失敗: {e}")
-                continue
-
-        if df is None or df.empty:
-            return False, "無法讀取CSV文件，請檢查文件格式和編碼"
-
-        # 清理列名（移除特殊字符，確保符合SQL標準）
-        original_columns = df.columns.tolist()
-        cleaned_columns = []
-
-        for i, col in enumerate(original_columns):
-            # 清理列名
-            cleaned_col = str(col).strip()
-            # 移除或替換特殊字符
-            cleaned_col = (
-                cleaned_col.replace(" ", "_")
-                .replace("-", "_")
-                .replace("(", "_")
-                .replace(")", "_")
-            )
-            cleaned_col = (
-                cleaned_col.replace("[", "_").replace("]", "_").replace(".", "_")
-            )
-            cleaned_col = (
-                cleaned_col.replace("/", "_")
-                .replace("\\", "_")
-                .replace("'", "")
-                .replace('"', "")
-            )
-            cleaned_col = (
-                cleaned_col.replace("&", "and")
-                .replace("%", "percent")
-                .replace("#", "num")
-            )
-            cleaned_col = (
-                cleaned_col.replace("@", "at").replace("!", "").replace("?", "")
-            )
-
-            # 確保列名不是SQL關鍵字且以字母開頭
-            if not cleaned_col or cleaned_col[0].isdigit():
-                cleaned_col = f"col_{i}_{cleaned_col}"
-
-            # 限制列名長度
-            if len(cleaned_col) > 64:
-                cleaned_col = cleaned_col[:60] + f"_{i}"
-
-            # 確保列名唯一
-            base_col = cleaned_col
-            counter = 1
-            while cleaned_col in cleaned_columns:
-                cleaned_col = f"{base_col}_{counter}"
-                counter += 1
-                # 如果計數器讓列名過長，截短基礎名稱
-                if len(cleaned_col) > 64:
-                    base_col = base_col[:50]
-                    cleaned_col = f"{base_col}_{counter}"
-
-            cleaned_columns.append(cleaned_col)
-
-        df.columns = cleaned_columns
-        print(f"已清理 {len(cleaned_columns)} 個欄位名稱")
-
-        # 創建SQLite連接，並設置優化參數
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # 設置SQLite優化參數以處理大文件和大量列數
-        cursor.execute("PRAGMA journal_mode = MEMORY")
-        cursor.execute("PRAGMA synchronous = OFF")
-        cursor.execute("PRAGMA cache_size = 2000000")  # 增加緩存大小
-        cursor.execute("PRAGMA locking_mode = EXCLUSIVE")
-        cursor.execute("PRAGMA temp_store = MEMORY")
-        cursor.execute("PRAGMA mmap_size = 268435456")  # 256MB memory map
-        cursor.execute("PRAGMA page_size = 65536")  # 增加頁面大小
-
-        # 取得CSV檔案名稱作為表格名稱
-        table_name = os.path.splitext(os.path.basename(csv_path))[0]
-        # 清理表格名稱，確保符合SQL標準
-        table_name = (
-            table_name.replace(" ", "_")
-            .replace("-", "_")
-            .replace("(", "_")
-            .replace(")", "_")
-        )
-        table_name = table_name.replace("[", "_").replace("]", "_").replace(".", "_")
-
-        try:
-            # 對於正常列數，使用pandas的to_sql方法
-            # 動態調整寫入batch_size基於文件大小
-            file_size = os.path.getsize(csv_path)
-            if file_size > 30 * 1024 * 1024:  # 大於30MB
-                write_chunksize = 500
-            elif file_size > 10 * 1024 * 1024:  # 大於10MB
-                write_chunksize = 800
-            else:
-                write_chunksize = 1000
-
-            print(f"使用寫入chunksize: {write_chunksize}")
-
-            df.to_sql(
-                table_name,
-                conn,
-                if_exists="replace",
-                index=False,
-                method="multi",
-                chunksize=write_chunksize,
-            )
-
-            # 驗證數據是否成功插入
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-            row_count = cursor.fetchone()[0]
-
-            # 驗證列數
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            actual_columns = cursor.fetchall()
-
-            conn.close()
-            print(
-                f"CSV文件已成功轉換為SQLite，表格名稱: {table_name}，共 {row_count} 行數據，{len(actual_columns)} 列"
-            )
-            return True, table_name
-
-        except Exception as sql_error:
-            conn.close()
-            print(f"SQLite寫入錯誤: {sql_error}")
-            error_msg = str(sql_error)
-
-            if "too many columns" in error_msg.lower():
-                print("嘗試使用分片存儲策略...")
-                return convert_csv_to_sqlite_chunked(csv_path, db_path, encoding)
-            elif "database is locked" in error_msg.lower():
-                return False, f"數據庫被鎖定，請稍後重試。錯誤詳情: {error_msg}"
-            else:
-                return False, f"數據庫寫入失敗: {error_msg}"
-
-    except Exception as e:
-        print(f"CSV轉換錯誤: {e}")
-        # 提供更詳細的錯誤信息
-        error_msg = str(e)
-        if "too many columns" in error_msg.lower():
-            return (
-                False,
-                f"CSV文件欄位數量過多。SQLite 在處理大量欄位時有限制，建議：1) 減少欄位數量 2) 將數據分割為多個文件。錯誤詳情: {error_msg}",
-            )
-        elif "memory" in error_msg.lower() or "out of memory" in error_msg.lower():
-            return (
-                False,
-                f"文件過大導致記憶體不足。建議：1) 減少文件大小到30MB以下 2) 移除不需要的欄位。錯誤詳情: {error_msg}",
-            )
-        elif "encoding" in error_msg.lower():
-            return False, f"文件編碼問題，請檢查文件編碼格式。錯誤詳情: {error_msg}"
-        elif "disk space" in error_msg.lower() or "no space" in error_msg.lower():
-            return False, f"磁盤空間不足，請清理磁盤空間後重試。錯誤詳情: {error_msg}"
-        else:
-            return False, f"CSV轉換失敗: {error_msg}"
-
-
-def convert_csv_to_sqlite_chunked(csv_path, db_path, encoding):
-    """
-    使用分片策略處理超大列數的CSV文件
-    將大量列分割成多個較小的表格
-    """
-    try:
-        print("開始使用分片存儲策略處理超大列數CSV文件...")
-
-        # 讀取CSV文件頭部信息
-        df_sample = pd.read_csv(csv_path, encoding=encoding, nrows=1)
-        total_columns = len(df_sample.columns)
-
-        # 設定每個分片的最大列數（保守設定為1000列）
-        max_columns_per_chunk = 1000
-        num_chunks = (
-            total_columns + max_columns_per_chunk - 1
-        ) // max_columns_per_chunk
+def invalidate_database_caches(db_path):
+    """資料庫文件被重新上傳後，釋放舊版本佔用的 agent、schema 與查詢結果快取"""
+    agent_pool.invalidate(db_path)
+    read_pool.invalidate(db_path)
+    result_cache.invalidate(db_path)
+    schema_cache.invalidate(db_path)
 
-        print(
-            f"將 {total_columns} 列分成 {num_chunks} 個分片，每片最多 {max_columns_per_chunk} 列"
-        )
-
-        # 創建SQLite連接
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # 設置SQLite優化參數
-        cursor.execute("PRAGMA journal_mode = MEMORY")
-        cursor.execute("PRAGMA synchronous = OFF")
-        cursor.execute("PRAGMA cache_size = 2000000")  # 增加緩存大小
-        cursor.execute("PRAGMA locking_mode = EXCLUSIVE")
-        cursor.execute("PRAGMA temp_store = MEMORY")
-        cursor.execute("PRAGMA mmap_size = 268435456")  # 256MB memory map
-        cursor.execute("PRAGMA page_size = 65536")  # 增加頁面大小
-
-        # 基礎表格名稱
-        base_table_name = os.path.splitext(os.path.basename(csv_path))[0]
-        base_table_name = (
-            base_table_name.replace(" ", "_")
-            .replace("-", "_")
-            .replace("(", "_")
-            .replace(")", "_")
-        )
-        base_table_name = (
-            base_table_name.replace("[", "_").replace("]", "_").replace(".", "_")
-        )
-
-        successful_tables = []
-
-        # 分片處理
-        for chunk_idx in range(num_chunks):
-            start_col = chunk_idx * max_columns_per_chunk
-            end_col = min((chunk_idx + 1) * max_columns_per_chunk, total_columns)
-
-            print(
-                f"處理分片 {chunk_idx + 1}/{num_chunks}: 列 {start_col} 到 {end_col - 1}"
-            )
-
-            try:
-                # 確定要讀取的列
-                if chunk_idx == 0:
-                    # 第一個分片包含日期列
-                    cols_to_read = list(range(start_col, end_col))
-                else:
-                    # 其他分片包含第一列（日期）和當前分片的列
-                    cols_to_read = [0] + list(range(start_col, end_col))
-
-                # 分塊讀取數據，動態調整chunk_size
-                file_size = os.path.getsize(csv_path)
-                if file_size > 30 * 1024 * 1024:  # 大於30MB
-                    read_chunk_size = 2000
-                elif file_size > 10 * 1024 * 1024:  # 大於10MB
-                    read_chunk_size = 3000
-                else:
-                    read_chunk_size = 5000
-
-                chunk_dfs = []
-                for chunk in pd.read_csv(
-                    csv_path,
-                    encoding=encoding,
-                    chunksize=read_chunk_size,
-                    usecols=cols_to_read,
-                ):
-                    if not chunk.empty:
-                        chunk_dfs.append(chunk)
-
-                if not chunk_dfs:
-                    continue
-
-                df_chunk = pd.concat(chunk_dfs, ignore_index=True)
-
-                # 清理列名
-                cleaned_columns = []
-                for i, col in enumerate(df_chunk.columns):
-                    cleaned_col = str(col).strip()
-                    cleaned_col = (
-                        cleaned_col.replace(" ", "_")
-                        .replace("-", "_")
-                        .replace("(", "_")
-                        .replace(")", "_")
-                    )
-                    cleaned_col = (
-                        cleaned_col.replace("[", "_")
-                        .replace("]", "_")
-                        .replace(".", "_")
-                    )
-                    cleaned_col = (
-                        cleaned_col.replace("/", "_")
-                        .replace("\\", "_")
-                        .replace("'", "")
-                        .replace('"', "")
-                    )
-                    cleaned_col = (
-                        cleaned_col.replace("&", "and")
-                        .replace("%", "percent")
-                        .replace("#", "num")
-                    )
-                    cleaned_col = (
-                        cleaned_col.replace("@", "at").replace("!", "").replace("?", "")
-                    )
-
-                    if not cleaned_col or cleaned_col[0].isdigit():
-                        cleaned_col = f"col_{i}_{cleaned_col}"
-
-                    if len(cleaned_col) > 64:
-                        cleaned_col = cleaned_col[:60] + f"_{i}"
-
-                    # 確保列名唯一
-                    base_col = cleaned_col
-                    counter = 1
-                    while cleaned_col in cleaned_columns:
-                        cleaned_col = f"{base_col}_{counter}"
-                        counter += 1
-                        if len(cleaned_col) > 64:
-                            base_col = base_col[:50]
-                            cleaned_col = f"{base_col}_{counter}"
-
-                    cleaned_columns.append(cleaned_col)
-
-                df_chunk.columns = cleaned_columns
-
-                # 生成表格名稱
-                if chunk_idx == 0:
-                    table_name = base_table_name
-                else:
-                    table_name = f"{base_table_name}_part_{chunk_idx + 1}"
-
-                # 寫入SQLite，動態調整寫入batch_size
-                file_size = os.path.getsize(csv_path)
-                if file_size > 30 * 1024 * 1024:  # 大於30MB
-                    write_chunk_size = 300
-                elif file_size > 10 * 1024 * 1024:  # 大於10MB
-                    write_chunk_size = 400
-                else:
-                    write_chunk_size = 500
-
-                df_chunk.to_sql(
-                    table_name,
-                    conn,
-                    if_exists="replace",
-                    index=False,
-                    method="multi",
-                    chunksize=write_chunk_size,
-                )
 
-                # 驗證數據
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                row_count = cursor.fetchone()[0]
-
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                actual_columns = cursor.fetchall()
-
-                successful_tables.append(table_name)
-                print(
-                    f"成功創建表格 {table_name}: {row_count} 行, {len(actual_columns)} 列"
-                )
-
-            except Exception as chunk_error:
-                print(f"分片 {chunk_idx + 1} 處理失敗: {chunk_error}")
-                continue
-
-        conn.close()
-
-        if successful_tables:
-            # 創建一個主表的視圖或者返回第一個表作為主表
-            main_table = successful_tables[0]
-            result_message = f"CSV文件已成功轉換為SQLite，創建了 {len(successful_tables)} 個表格。主表格: {main_table}"
-            if len(successful_tables) > 1:
-                result_message += f"，其他表格: {', '.join(successful_tables[1:])}"
-
-            print(result_message)
-            return True, main_table
-        else:
-            return False, "所有分片處理都失敗了"
-
-    except Exception as e:
-        print(f"分片處理錯誤: {e}")
-        return False, f"分片處理失敗: {str(e)}"
+def run_csv_ingest_job(csv_path, db_path, progress):
+    """背景匯入工作：轉換CSV並清除舊版本的快取"""
+    success, result = convert_csv_to_sqlite(csv_path, db_path, progress=progress)
+    invalidate_database_caches(db_path)
+    if not success:
+        raise RuntimeError(result)
+    return result
 
 
 def is_csv_file(filename):
@@ -449,56 +67,65 @@ def is_csv_file(filename):
 
 def get_table_info(db_path):
     """獲取資料庫中所有表格的資訊"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    with read_pool.connection(db_path) as conn:
+        cursor = conn.cursor()
 
-    # 獲取所有表格名稱
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
+        # 獲取所有表格名稱
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = cursor.fetchall()
 
-    table_info = {}
-    for table in tables:
-        table_name = table[0]
-        # 獲取表格結構
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
+        table_info = {}
+        for table in tables:
+            table_name = table[0]
+            # 獲取表格結構
+            cursor.execute(f"PRAGMA table_info({table_name});")
+            columns = cursor.fetchall()
 
-        # 獲取前5行數據作為示例
-        cursor.execute(f"SELECT * FROM {table_name} LIMIT 5;")
-        sample_data = cursor.fetchall()
+            # 獲取前5行數據作為示例
+            cursor.execute(f"SELECT * FROM {table_name} LIMIT 5;")
+            sample_data = cursor.fetchall()
 
-        table_info[table_name] = {"columns": columns, "sample_data": sample_data}
+            table_info[table_name] = {"columns": columns, "sample_data": sample_data}
+        cursor.close()
 
-    conn.close()
     return table_info
 
 
-def execute_sql_query(db_path, query):
-    """執行SQL查詢並返回結果"""
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(query)
-
-        # 獲取列名
-        columns = (
-            [description[0] for description in cursor.description]
-            if cursor.description
-            else []
-        )
+def execute_sql_query(
+    db_path, query, page_size=None, cursor=None, with_total=False, query_id=None
+):
+    """執行SQL查詢並返回單頁結果，超過執行預算或被取消時回傳結構化錯誤"""
+    return execute_sql(
+        db_path,
+        query,
+        page_size=page_size,
+        cursor=cursor,
+        with_total=with_total,
+        query_id=query_id,
+    )
 
-        # 獲取數據
-        results = cursor.fetchall()
-        conn.close()
 
-        return {
-            "success": True,
-            "columns": columns,
-            "data": results,
-            "row_count": len(results),
-        }
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+def format_agent_result(agent_result, natural_query, model_type):
+    """整理 SQLAgent 的輸出，表格資料直接取自 agent 執行 SQL 時的結構化結果"""
+    return {
+        "success": True,
+        "generated_sql": agent_result.get("query", ""),
+        "natural_query": natural_query,
+        "generation": agent_result.get("generation", ""),
+        "sql_result": agent_result.get("result", ""),
+        "model_type": model_type,
+        "cache_hit": agent_result.get("cache_hit", False),
+        "data": agent_result.get("rows", []),
+        "columns": agent_result.get("columns", []),
+        "row_count": agent_result.get("row_count", 0),
+        "has_more": agent_result.get("has_more", False),
+        "next_cursor": agent_result.get("next_cursor"),
+        "total_count": agent_result.get("total_count"),
+        "elapsed_ms": agent_result.get("elapsed_ms", 0.0),
+        "execution_error": agent_result.get("error"),
+        "answer_source": agent_result.get("answer_source"),
+        "answer_from_summary": agent_result.get("answer_from_summary", False),
+    }
 
 
 @app.route("/")
@@ -521,6 +148,7 @@ def upload_file():
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
         file.save(filepath)
+        invalidate_database_caches(filepath)
 
         # 檢查是否為CSV文件，如果是則轉換為SQLite
         if is_csv_file(filename):
@@ -528,19 +156,22 @@ def upload_file():
             db_filename = os.path.splitext(filename)[0] + ".db"
             db_filepath = os.path.join(app.config["UPLOAD_FOLDER"], db_filename)
 
-            # 轉換CSV為SQLite
-            success, result = convert_csv_to_sqlite(filepath, db_filepath)
-
-            if success:
-                # 獲取資料庫資訊
-                table_info = get_table_info(db_filepath)
-                flash(f"CSV文件已成功轉換為SQLite資料庫，表格名稱: {result}")
-                return render_template(
-                    "database_info.html", filename=db_filename, table_info=table_info
-                )
-            else:
-                flash(f"CSV轉換失敗: {result}")
-                return redirect(request.url)
+            # 將CSV轉換交給背景工作，立即回傳 job id
+            job_id = ingest_jobs.submit(
+                run_csv_ingest_job,
+                filepath,
+                db_filepath,
+                total_bytes=os.path.getsize(filepath),
+                filename=filename,
+                db_filename=db_filename,
+            )
+            job_urls = {
+                "status_url": url_for("api_ingest_job", job_id=job_id),
+                "result_url": url_for("ingest_job_result", job_id=job_id),
+            }
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify({"success": True, "job_id": job_id, **job_urls})
+            return redirect(job_urls["result_url"])
         else:
             # 原有的SQLite文件處理邏輯
             table_info = get_table_info(filepath)
@@ -552,6 +183,39 @@ def upload_file():
         return redirect(request.url)
 
 
+@app.route("/api/ingest_jobs/<job_id>")
+def api_ingest_job(job_id):
+    """查詢CSV背景匯入工作的進度"""
+    status = ingest_jobs.status(job_id)
+    if status is None:
+        return jsonify({"success": False, "error": "匯入工作不存在"}), 404
+    return jsonify({"success": True, "job": status})
+
+
+@app.route("/ingest_jobs/<job_id>")
+def ingest_job_result(job_id):
+    """匯入完成後顯示資料庫資訊"""
+    status = ingest_jobs.status(job_id)
+    if status is None:
+        flash("匯入工作不存在")
+        return redirect(url_for("index"))
+
+    if status["status"] == "failed":
+        flash(f"CSV轉換失敗: {status['error']}")
+        return redirect(url_for("index"))
+
+    if status["status"] != "succeeded":
+        return jsonify({"success": True, "job": status}), 202
+
+    db_filename = status["db_filename"]
+    db_filepath = os.path.join(app.config["UPLOAD_FOLDER"], db_filename)
+    table_info = get_table_info(db_filepath)
+    flash(f"CSV文件已成功轉換為SQLite資料庫，表格名稱: {status['table_name']}")
+    return render_template(
+        "database_info.html", filename=db_filename, table_info=table_info
+    )
+
+
 @app.route("/compare/<filename>")
 def compare_queries(filename):
     filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
@@ -592,7 +256,10 @@ def use_default_data():
         if success:
             # 獲取資料庫資訊
             table_info = get_table_info(db_filepath)
-            flash(f"已成功載入預設的簡易交易資料，表格名稱: {result}")
+            flash(
+                f"已成功載入預設的簡易交易資料，表格名稱: {result['table_name']}"
+                f"（編碼: {result['encoding']}）"
+            )
             return render_template(
                 "database_info.html", filename=db_filename, table_info=table_info
             )
@@ -615,10 +282,28 @@ def api_sql_query():
     if not os.path.exists(filepath):
         return jsonify({"success": False, "error": "資料庫文件不存在"})
 
-    result = execute_sql_query(filepath, query)
+    result = execute_sql_query(
+        filepath,
+        query,
+        page_size=data.get("page_size"),
+        cursor=data.get("cursor"),
+        with_total=bool(data.get("with_total")),
+        query_id=data.get("query_id"),
+    )
     return jsonify(result)
 
 
+@app.route("/api/cancel_query", methods=["POST"])
+def api_cancel_query():
+    """取消執行中的查詢（SQL 查詢或 SQL Agent 執行的 SQL）"""
+    data = request.json
+    try:
+        running_here = cancel_query(data.get("query_id"))
+        return jsonify({"success": True, "running_here": running_here})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)})
+
+
 @app.route("/api/validate_api_key", methods=["POST"])
 def api_validate_api_key():
     """驗證 OpenAI 或 Google API Key 是否有效"""
@@ -630,90 +315,11 @@ def api_validate_api_key():
         if not api_key:
             return jsonify({"success": False, "error": "請提供 API Key"})
 
-        # 暫時設置環境變量以測試 API Key
-        if model_type == "openai":
-            original_api_key = os.environ.get("OPENAI_API_KEY")
-            os.environ["OPENAI_API_KEY"] = api_key
-
-            try:
-                # 創建測試用的 OpenAI LLM 實例
-                test_llm = ChatOpenAI(
-                    model="gpt-4.1-nano", temperature=0, api_key=api_key
-                )
-
-                # 進行一個簡單的測試調用
-                _ = test_llm.invoke("Hello")
-
-                # 如果到這裡沒有拋出異常，說明 API Key 有效
-                return jsonify({"success": True, "message": "OpenAI API Key 驗證成功"})
-
-            except Exception as e:
-                error_msg = str(e)
-                if (
-                    "invalid api key" in error_msg.lower()
-                    or "unauthorized" in error_msg.lower()
-                ):
-                    return jsonify({"success": False, "error": "OpenAI API Key 無效"})
-                elif "quota" in error_msg.lower():
-                    return jsonify({"success": False, "error": "OpenAI API 配額已用盡"})
-                else:
-                    return jsonify(
-                        {
-                            "success": False,
-                            "error": f"OpenAI API Key 驗證失敗: {error_msg}",
-                        }
-                    )
-            finally:
-                # 恢復原始的 API Key
-                if original_api_key:
-                    os.environ["OPENAI_API_KEY"] = original_api_key
-                elif "OPENAI_API_KEY" in os.environ:
-                    del os.environ["OPENAI_API_KEY"]
-
-        elif model_type == "gemini":
-            original_api_key = os.environ.get("GOOGLE_API_KEY")
-            os.environ["GOOGLE_API_KEY"] = api_key
-
-            try:
-                test_llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.5-flash", temperature=0, google_api_key=api_key
-                )
-
-                # 進行一個簡單的測試調用
-                _ = test_llm.invoke("Hello")
-
-                # 如果到這裡沒有拋出異常，說明 API Key 有效
-                return jsonify(
-                    {"success": True, "message": "Google Gemini API Key 驗證成功"}
-                )
-
-            except Exception as e:
-                error_msg = str(e)
-                if (
-                    "invalid api key" in error_msg.lower()
-                    or "unauthorized" in error_msg.lower()
-                    or "api key not valid" in error_msg.lower()
-                ):
-                    return jsonify({"success": False, "error": "Google API Key 無效"})
-                elif "quota" in error_msg.lower():
-                    return jsonify({"success": False, "error": "Google API 配額已用盡"})
-                else:
-                    return jsonify(
-                        {
-                            "success": False,
-                            "error": f"Google API Key 驗證失敗: {error_msg}",
-                        }
-                    )
-            finally:
-                # 恢復原始的 API Key
-                if original_api_key:
-                    os.environ["GOOGLE_API_KEY"] = original_api_key
-                elif "GOOGLE_API_KEY" in os.environ:
-                    del os.environ["GOOGLE_API_KEY"]
-
-        else:
-            return jsonify({"success": False, "error": "不支持的模型類型"})
+        # 以不耗用 token 的模型查詢驗證，結果依加鹽雜湊快取
+        return jsonify(key_validator.validate(model_type, api_key))
 
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)})
     except Exception as e:
         return jsonify({"success": False, "error": f"驗證過程中發生錯誤: {str(e)}"})
 
@@ -733,18 +339,14 @@ def api_table_info():
         return jsonify({"success": False, "error": "資料庫文件不存在"})
 
     try:
-        conn = sqlite3.connect(filepath)
-        cursor = conn.cursor()
-
-        # 獲取表格結構
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
+        with read_pool.connection(filepath) as conn:
+            # 獲取表格結構
+            columns = conn.execute(f"PRAGMA table_info({table_name});").fetchall()
 
-        # 獲取前5行數據作為示例
-        cursor.execute(f"SELECT * FROM {table_name} LIMIT 5;")
-        sample_data = cursor.fetchall()
-
-        conn.close()
+            # 獲取前5行數據作為示例
+            sample_data = conn.execute(
+                f"SELECT * FROM {table_name} LIMIT 5;"
+            ).fetchall()
 
         table_info = {"columns": columns, "sample_data": sample_data}
 
@@ -770,75 +372,237 @@ def api_agent_query():
         return jsonify({"success": False, "error": "資料庫文件不存在"})
 
     try:
-        # 根據模型類型設置環境變量
-        if model_type == "openai":
-            original_api_key = os.environ.get("OPENAI_API_KEY")
-            os.environ["OPENAI_API_KEY"] = api_key
-        elif model_type == "gemini":
-            original_api_key = os.environ.get("GOOGLE_API_KEY")
-            os.environ["GOOGLE_API_KEY"] = api_key
+        # 從共用的 agent pool 取得 SQLAgent，重用已反射的 schema 與 LLM 連線；
+        # API Key 只透過參數傳給 LLM 客戶端，不寫入共用的環境變數
+        sql_agent = agent_pool.get(filepath, api_key=api_key, model_type=model_type)
+
+        # 使用 SQLAgent 處理自然語言查詢
+        agent_result = sql_agent.run(
+            natural_query,
+            page_size=data.get("page_size"),
+            bypass_cache=bool(data.get("bypass_cache")),
+            query_id=data.get("query_id"),
+            answer_mode=data.get("answer_mode"),
+        )
+        app.logger.info(
+            "Agent query: rows=%s elapsed_ms=%s cache_hit=%s answer_source=%s",
+            agent_result.get("row_count", 0),
+            agent_result.get("elapsed_ms", 0.0),
+            agent_result.get("cache_hit", False),
+            agent_result.get("answer_source"),
+        )
+
+        return jsonify(format_agent_result(agent_result, natural_query, model_type))
+
+    except Exception as e:
+        return jsonify(
+            {
+                "success": False,
+                "error": f"SQL Agent 處理時發生錯誤: {str(e)}",
+            }
+        )
 
-        try:
-            # 建立 SQLAgent 實例，傳遞模型類型和 API Key
-            db_uri = f"sqlite:///{filepath}"
-            sql_agent = SQLAgent(db_uri, api_key=api_key, model_type=model_type)
-
-            # 使用 SQLAgent 處理自然語言查詢
-            agent_result = sql_agent.run(natural_query)
-            print("Agent Result:", agent_result)
-
-            # 如果有生成的SQL，執行它來獲取實際的查詢結果
-            sql_query_result = None
-            if agent_result.get("query") and agent_result.get("query") != "查無結果":
-                sql_query_result = execute_sql_query(
-                    filepath, agent_result.get("query")
-                )
 
-            # 格式化回應
-            result = {
+@app.route("/api/cache_stats")
+def api_cache_stats():
+    """查詢 NL2SQL、查詢結果、API Key 驗證快取與唯讀連線池的統計"""
+    try:
+        return jsonify(
+            {
                 "success": True,
-                "generated_sql": agent_result.get("query", ""),
-                "natural_query": natural_query,
-                "generation": agent_result.get("generation", ""),
-                "sql_result": agent_result.get("result", ""),
-                "model_type": model_type,
+                "nl2sql": nl2sql_cache.stats(),
+                "results": result_cache.stats(),
+                "connections": read_pool.stats(),
+                "api_keys": key_validator.stats(),
             }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "error": f"讀取快取統計失敗: {str(e)}"})
 
-            # 如果有SQL查詢結果，添加表格資料
-            if sql_query_result and sql_query_result.get("success"):
-                result.update(
-                    {
-                        "data": sql_query_result.get("data", []),
-                        "columns": sql_query_result.get("columns", []),
-                        "row_count": sql_query_result.get("row_count", 0),
-                    }
-                )
-            else:
-                result.update({"data": [], "columns": [], "row_count": 0})
-
-            return jsonify(result)
-
-        finally:
-            # 恢復原始的 API Key
-            if model_type == "openai":
-                if original_api_key:
-                    os.environ["OPENAI_API_KEY"] = original_api_key
-                elif "OPENAI_API_KEY" in os.environ:
-                    del os.environ["OPENAI_API_KEY"]
-            elif model_type == "gemini":
-                if original_api_key:
-                    os.environ["GOOGLE_API_KEY"] = original_api_key
-                elif "GOOGLE_API_KEY" in os.environ:
-                    del os.environ["GOOGLE_API_KEY"]
 
+@app.route("/metrics")
+def prometheus_metrics():
+    """以 Prometheus 文字格式輸出所有 worker 加總的延遲、token 與快取指標"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/index_advisor", methods=["POST"])
+def api_index_advisor():
+    """根據查詢紀錄列出建議建立的索引與已建立的索引"""
+    data = request.json
+    filename = data.get("filename")
+
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.exists(filepath):
+        return jsonify({"success": False, "error": "資料庫文件不存在"})
+
+    try:
+        return jsonify(
+            {
+                "success": True,
+                "mode": index_advisor.mode,
+                "recommendations": index_advisor.advise(filepath),
+                "indexes": index_advisor.indexes(filepath),
+            }
+        )
     except Exception as e:
+        return jsonify({"success": False, "error": f"分析索引建議失敗: {str(e)}"})
+
+
+@app.route("/api/index_advisor/apply", methods=["POST"])
+def api_index_advisor_apply():
+    """建立（可指定名稱的）建議索引，並回報建立前後的查詢耗時"""
+    data = request.json
+    filename = data.get("filename")
+
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.exists(filepath):
+        return jsonify({"success": False, "error": "資料庫文件不存在"})
+
+    try:
+        results = index_advisor.apply(filepath, names=data.get("names"))
+        if any(result["status"] == "created" for result in results):
+            invalidate_database_caches(filepath)
+        return jsonify({"success": True, "results": results})
+    except Exception as e:
+        return jsonify({"success": False, "error": f"建立索引失敗: {str(e)}"})
+
+
+@app.route("/api/agent_query_stream", methods=["POST"])
+def api_agent_query_stream():
+    """以 NDJSON 串流回傳 SQL Agent 每個階段的結果"""
+    data = request.json
+    filename = data.get("filename")
+    natural_query = data.get("query")
+    api_key = data.get("api_key")
+    model_type = data.get("model_type", "openai")
+
+    if not api_key:
+        return jsonify({"success": False, "error": "請提供 API Key"})
+
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.exists(filepath):
+        return jsonify({"success": False, "error": "資料庫文件不存在"})
+
+    def generate():
+        try:
+            sql_agent = agent_pool.get(filepath, api_key=api_key, model_type=model_type)
+            for event, payload in sql_agent.stream(
+                natural_query,
+                page_size=data.get("page_size"),
+                bypass_cache=bool(data.get("bypass_cache")),
+                query_id=data.get("query_id"),
+                answer_mode=data.get("answer_mode"),
+            ):
+                payload["event"] = event
+                yield json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+            yield json.dumps({"event": "done", "model_type": model_type}) + "\n"
+        except Exception as e:
+            yield json.dumps(
+                {"event": "error", "error": f"SQL Agent 處理時發生錯誤: {str(e)}"},
+                ensure_ascii=False,
+            ) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        # 關閉 nginx 緩衝，讓每個事件立即送達瀏覽器
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+    )
+
+
+@app.route("/api/agent_batch", methods=["POST"])
+def api_agent_batch():
+    """批次回答多個問題，以 NDJSON 依完成順序串流回傳每題結果"""
+    data = request.json
+    filename = data.get("filename")
+    questions = data.get("questions")
+    api_key = data.get("api_key")
+    model_type = data.get("model_type", "openai")
+
+    if not api_key:
+        return jsonify({"success": False, "error": "請提供 API Key"})
+    if (
+        not isinstance(questions, list)
+        or not questions
+        or not all(isinstance(q, str) and q.strip() for q in questions)
+    ):
+        return jsonify({"success": False, "error": "請提供問題列表"})
+    if len(questions) > MAX_BATCH_QUESTIONS:
         return jsonify(
             {
                 "success": False,
-                "error": f"SQL Agent 處理時發生錯誤: {str(e)}",
+                "error": f"單次批次最多 {MAX_BATCH_QUESTIONS} 個問題",
             }
         )
 
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.exists(filepath):
+        return jsonify({"success": False, "error": "資料庫文件不存在"})
+
+    try:
+        sql_agent = agent_pool.get(filepath, api_key=api_key, model_type=model_type)
+    except Exception as e:
+        return jsonify({"success": False, "error": f"SQL Agent 初始化失敗: {str(e)}"})
+
+    batch = BatchRun(
+        sql_agent,
+        questions,
+        concurrency=data.get("concurrency"),
+        page_size=data.get("page_size"),
+        bypass_cache=bool(data.get("bypass_cache")),
+        answer_mode=data.get("answer_mode"),
+    )
+
+    def generate():
+        start = time.monotonic()
+        succeeded = failed = 0
+        yield json.dumps(
+            {
+                "event": "start",
+                "total": batch.total,
+                "unique": len(batch.groups),
+                "concurrency": batch.concurrency,
+                "model_type": model_type,
+            }
+        ) + "\n"
+        for item in batch.results():
+            if item["error"]:
+                failed += 1
+                payload = {
+                    "success": False,
+                    "natural_query": item["question"],
+                    "error": f"SQL Agent 處理時發生錯誤: {item['error']}",
+                }
+            else:
+                succeeded += 1
+                payload = format_agent_result(
+                    item["result"], item["question"], model_type
+                )
+            payload.update(
+                event="result",
+                index=item["index"],
+                positions=item["positions"],
+                batch_elapsed_ms=item["batch_elapsed_ms"],
+            )
+            yield json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+        elapsed = max(time.monotonic() - start, 1e-6)
+        yield json.dumps(
+            {
+                "event": "done",
+                "succeeded": succeeded,
+                "failed": failed,
+                "elapsed_ms": round(elapsed * 1000, 2),
+                "questions_per_second": round((succeeded + failed) / elapsed, 2),
+            }
+        ) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+    )
+
 
 if __name__ == "__main__":
     # 開發環境
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+# 服務位址
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+
+# 每個 worker 以多執行緒處理請求，等待 LLM 回應時不會佔住整個 worker；
+# 若已安裝 gevent，可設定 GUNICORN_WORKER_CLASS=gevent
+workers = int(
+    os.environ.get("GUNICORN_WORKERS", str(min(multiprocessing.cpu_count(), 4)))
+)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "64"))
+
+# LLM 請求與串流回應可能較久，與 nginx 的 proxy_read_timeout 一致
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    """清除上次執行留下的 /metrics 快照，計數從伺服器啟動時重新開始"""
+    from services.metrics import metrics
+
+    metrics.clear()
@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from services.llm_factory import credential_fingerprint
+from services.sql_agent import SQLAgent
+
+logger = logging.getLogger(__name__)
+
+
+class AgentPool:
+    """
+    A process-wide LRU registry of long-lived SQLAgent instances.
+
+    Building a SQLAgent reflects the whole schema through SQLAlchemy and
+    looks up an LLM client. The pool keeps agents alive between requests so
+    warm requests reuse the reflected SQLDatabase and the client's keep-alive
+    connections.
+
+    Agents are keyed by (database file, file mtime, model_type, credential
+    fingerprint). Re-uploading a file changes its mtime, so a stale agent is
+    never returned for a replaced database.
+
+    Attributes:
+        max_size (int): Maximum number of agents kept alive at once.
+    """
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._agents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_key(self, db_path, model_type, api_key):
+        abs_path = os.path.abspath(db_path)
+        return (
+            abs_path,
+            os.stat(abs_path).st_mtime_ns,
+            model_type,
+            credential_fingerprint(api_key),
+        )
+
+    def get(self, db_path, api_key=None, model_type="openai"):
+        """
+        Return a cached SQLAgent for the database file, building one on a miss.
+
+        Args:
+            db_path (str): Filesystem path of the SQLite database.
+            api_key (str): The caller's LLM API key.
+            model_type (str): "openai" or "gemini".
+
+        Returns:
+            SQLAgent: A ready-to-use agent.
+        """
+        key = self._make_key(db_path, model_type, api_key)
+
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                return agent
+
+        # 在鎖外建立 agent，避免 schema 反射阻塞其他請求
+        agent = SQLAgent(f"sqlite:///{key[0]}", api_key=api_key, model_type=model_type)
+
+        with self._lock:
+            existing = self._agents.get(key)
+            if existing is not None:
+                self._agents.move_to_end(key)
+                self._dispose(agent)
+                return existing
+
+            # 同一個檔案的舊版本（mtime 不同）已經失效，直接移除
+            stale_keys = [k for k in self._agents if k[0] == key[0] and k[1] != key[1]]
+            for stale_key in stale_keys:
+                self._dispose(self._agents.pop(stale_key))
+
+            self._agents[key] = agent
+            while len(self._agents) > self.max_size:
+                _, evicted = self._agents.popitem(last=False)
+                self._dispose(evicted)
+
+        logger.info("AgentPool: created agent for %s (%s)", key[0], model_type)
+        return agent
+
+    def invalidate(self, db_path):
+        """Drop every cached agent that points at the given database file"""
+        abs_path = os.path.abspath(db_path)
+        with self._lock:
+            for key in [k for k in self._agents if k[0] == abs_path]:
+                self._dispose(self._agents.pop(key))
+
+    def clear(self):
+        """Drop all cached agents"""
+        with self._lock:
+            while self._agents:
+                _, agent = self._agents.popitem()
+                self._dispose(agent)
+
+    def __len__(self):
+        return len(self._agents)
+
+    @staticmethod
+    def _dispose(agent):
+        try:
+            agent.database._engine.dispose()
+        except Exception as e:
+            logger.warning("AgentPool: failed to dispose engine: %s", e)
+
+
+agent_pool = AgentPool(max_size=int(os.environ.get("SQL_AGENT_POOL_SIZE", "8")))
@@ -0,0 +1,126 @@
+import os
+import re
+
+# 回答模式：fast 一律本地模板、auto 簡單結果用模板其餘交給 LLM、llm 一律呼叫 LLM
+ANSWER_MODES = ("fast", "auto", "llm")
+DEFAULT_ANSWER_MODE = os.environ.get("SQL_AGENT_ANSWER_MODE", "auto")
+
+# 「簡單結果」的形狀上限
+MAX_SIMPLE_ROWS = 10
+MAX_SIMPLE_COLUMNS = 6
+
+# fast 模式處理複雜結果時列出的筆數
+MAX_LISTED_ROWS = 10
+
+_AGGREGATE_LABELS = {
+    "count": "數量",
+    "sum": "總和",
+    "total": "總和",
+    "avg": "平均值",
+    "max": "最大值",
+    "min": "最小值",
+}
+
+
+def resolve_answer_mode(mode):
+    """Returns mode if it is a known answer mode, else the configured default"""
+    return mode if mode in ANSWER_MODES else DEFAULT_ANSWER_MODE
+
+
+def _column_label(column):
+    # 未命名的聚合欄位（如 COUNT(*)）改用中文名稱
+    match = re.fullmatch(r"\s*(\w+)\s*\(.*\)\s*", column or "", re.DOTALL)
+    if match and match.group(1).lower() in _AGGREGATE_LABELS:
+        return _AGGREGATE_LABELS[match.group(1).lower()]
+    return column
+
+
+def format_value(value):
+    """Formats a cell for display: grouped integers, two-decimal floats"""
+    if value is None:
+        return "（空值）"
+    if isinstance(value, bool):
+        return "是" if value else "否"
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        if value.is_integer():
+            return f"{int(value):,}"
+        if abs(value) >= 1:
+            return f"{value:,.2f}"
+        return f"{value:.4g}"
+    return str(value)
+
+
+def _count_text(row_count, shown, has_more, total_count):
+    if not has_more:
+        text = f"共 {row_count:,} 筆"
+    elif total_count:
+        text = f"共 {total_count:,} 筆"
+    else:
+        text = f"超過 {row_count:,} 筆"
+    if has_more or shown < row_count:
+        text += f"，以下列出前 {shown:,} 筆"
+    return text
+
+
+def _numbered(lines):
+    return "\n".join(f"{i}. {line}" for i, line in enumerate(lines, 1))
+
+
+def render_answer(columns, rows, has_more=False, total_count=None, simple_only=True):
+    """
+    Renders a Traditional Chinese answer from a structured SQL result.
+
+    Simple shapes are an empty result, a single row of up to MAX_SIMPLE_COLUMNS
+    values (including a lone scalar such as a COUNT(*)), and up to
+    MAX_SIMPLE_ROWS rows of one or two columns, such as a short ranking. Any
+    other result is complex.
+
+    Args:
+        columns (list): Column names of the result.
+        rows (list): Result rows.
+        has_more (bool): Whether rows were left out of this page.
+        total_count (int): Total number of rows, when known.
+        simple_only (bool): Return None for complex results instead of listing
+            the first MAX_LISTED_ROWS rows.
+
+    Returns:
+        str: The answer, or None when the result should be answered by the LLM.
+    """
+    if not rows:
+        return "根據查詢結果，查無符合條件的資料。"
+
+    labels = [_column_label(column) for column in columns]
+    row_count = len(rows)
+    simple = not has_more and (
+        (row_count == 1 and len(columns) <= MAX_SIMPLE_COLUMNS)
+        or (row_count <= MAX_SIMPLE_ROWS and len(columns) <= 2)
+    )
+
+    if simple and row_count == 1:
+        if len(columns) == 1:
+            return f"根據查詢結果，{labels[0]}為 {format_value(rows[0][0])}。"
+        details = "\n".join(
+            f"- {label}：{format_value(value)}" for label, value in zip(labels, rows[0])
+        )
+        return f"根據查詢結果：\n{details}"
+
+    if simple:
+        lines = ["：".join(format_value(value) for value in row) for row in rows]
+        count = _count_text(row_count, row_count, False, None)
+        header = f"根據查詢結果，{count}（{'：'.join(labels)}）"
+        return f"{header}：\n{_numbered(lines)}"
+
+    if simple_only:
+        return None
+
+    shown = min(row_count, MAX_LISTED_ROWS)
+    lines = [
+        "、".join(
+            f"{label}：{format_value(value)}" for label, value in zip(labels, row)
+        )
+        for row in rows[:shown]
+    ]
+    count = _count_text(row_count, shown, has_more, total_count)
+    return f"根據查詢結果，{count}：\n{_numbered(lines)}"
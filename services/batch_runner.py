@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+
+from services.query_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# 批次問題的預設並行數、上限與單批題數上限
+DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "32"))
+MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "1000"))
+
+_DONE = object()
+
+# 每個程序共用一個長駐的事件迴圈，由 _event_loop 建立
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    """
+    Returns the process-wide event loop batches run on, starting it if needed.
+
+    LLM clients are cached per process and their async HTTP pools stay bound to
+    the loop they were first used on, so every batch must run on the same loop
+    rather than a fresh one per batch.
+    """
+    global _loop, _loop_pid
+    pid = os.getpid()
+    with _loop_lock:
+        if _loop_pid != pid:
+            # gunicorn 會 fork worker，子程序沒有父程序的執行緒，需重新建立迴圈
+            _loop = asyncio.new_event_loop()
+            _loop_pid = pid
+            threading.Thread(
+                target=_loop.run_forever, name="agent-batch", daemon=True
+            ).start()
+        return _loop
+
+
+def dedupe_questions(questions):
+    """
+    Groups questions that normalize to the same text.
+
+    Returns:
+        list: (question, positions) pairs in first-seen order, where positions
+        are the indexes of every copy in the submitted list.
+    """
+    groups = {}
+    for position, question in enumerate(questions):
+        key = normalize_question(question)
+        if key in groups:
+            groups[key][1].append(position)
+        else:
+            groups[key] = (question, [position])
+    return list(groups.values())
+
+
+class BatchRun:
+    """
+    Answers a list of questions against one SQLAgent with bounded concurrency.
+
+    Questions are deduplicated, then answered through SQLAgent.arun on the
+    process-wide event loop from _event_loop, with at most concurrency
+    questions in flight. LLM request rates are enforced by the rate limiter of
+    the agent's LLM client, so throughput grows with the concurrency limit until
+    the provider's request budget is reached. Results are handed to the caller
+    in completion order as soon as each question finishes.
+
+    Attributes:
+        agent (SQLAgent): The agent answering every question.
+        groups (list): (question, positions) pairs from dedupe_questions.
+        concurrency (int): Maximum number of questions in flight.
+    """
+
+    def __init__(
+        self,
+        agent,
+        questions,
+        concurrency=None,
+        page_size=None,
+        bypass_cache=False,
+        answer_mode=None,
+    ):
+        self.agent = agent
+        self.groups = dedupe_questions(questions)
+        self.total = len(questions)
+        self.concurrency = max(
+            1, min(concurrency or DEFAULT_CONCURRENCY, MAX_CONCURRENCY)
+        )
+        self.page_size = page_size
+        self.bypass_cache = bypass_cache
+        self.answer_mode = answer_mode
+        self._results = queue.Queue()
+        self._future = None
+
+    async def _answer(self, semaphore, index, question, positions):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                result = await self.agent.arun(
+                    question,
+                    page_size=self.page_size,
+                    bypass_cache=self.bypass_cache,
+                    answer_mode=self.answer_mode,
+                )
+                error = None
+            except Exception as e:
+                logger.warning("Batch question %d failed: %s", index, e)
+                result, error = {}, str(e)
+        self._results.put(
+            {
+                "index": index,
+                "positions": positions,
+                "question": question,
+                "result": result,
+                "error": error,
+                "batch_elapsed_ms": round((time.monotonic() - start) * 1000, 2),
+            }
+        )
+
+    async def _run_all(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *(
+                self._answer(semaphore, index, question, positions)
+                for index, (question, positions) in enumerate(self.groups)
+            )
+        )
+
+    def _finish(self, future):
+        if future.cancelled():
+            logger.info("Batch run cancelled")
+        elif future.exception() is not None:
+            logger.error("Batch run failed: %s", future.exception())
+        self._results.put(_DONE)
+
+    def results(self):
+        """
+        Starts the batch and yields one dict per unique question as it completes.
+
+        Closing the generator early (for example when the client disconnects)
+        cancels the questions that have not finished.
+
+        Yields:
+            dict: index, positions, question, result (the SQLAgent output),
+            error and batch_elapsed_ms.
+        """
+        self._future = asyncio.run_coroutine_threadsafe(self._run_all(), _event_loop())
+        self._future.add_done_callback(self._finish)
+        try:
+            while True:
+                item = self._results.get()
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """Cancels the questions still pending or in flight"""
+        # 取消會以 call_soon_threadsafe 轉交給事件迴圈執行緒
+        if self._future is not None:
+            self._future.cancel()
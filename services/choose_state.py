@@ -1,21 +1,60 @@
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 from typing_extensions import Annotated
-from typing import List
+from typing import List, Optional
 
 
 class State(TypedDict):
     """State for the SQL retrieval process
     question: The question to ask the model.
     query: The generated SQL query.
-    result: The result of the SQL query.
+    bypass_cache: Skip the NL2SQL cache for this question.
+    cache_hit: Whether the query came from the NL2SQL cache.
+    cache_key: NL2SQL cache key, set when a freshly generated query may be cached.
+    validation_error: Why the last generated query failed local validation, if it did.
+    repair_attempts: Number of times the query was regenerated after validation.
+    result: The result of the SQL query, rendered as text for the answer prompt.
+    columns: Column names of the structured SQL result.
+    rows: Rows of the structured SQL result.
+    row_count: Number of rows in the returned page.
+    page_size: Requested page size for the structured result.
+    has_more: Whether more rows are available after this page.
+    next_cursor: Page token for fetching the next page through /api/sql_query.
+    total_count: Total number of rows, when known.
+    elapsed_ms: SQL execution time in milliseconds.
+    query_id: Client-chosen id that lets /api/cancel_query interrupt the SQL.
+    error: Structured error when the SQL was invalid, exceeded its budget or was
+    cancelled.
+    sql_error: SQLite's error message when the SQL failed for any other reason.
+    answer_mode: "fast", "auto" or "llm"; None uses the agent's default.
     answer: The answer to the question.
+    answer_source: "template", "llm" or "error", telling how the answer was made.
+    answer_from_summary: Whether the LLM answered from a summary of a large result.
     """
 
     question: str
     query: str
+    bypass_cache: bool
+    cache_hit: bool
+    cache_key: Optional[str]
+    validation_error: Optional[str]
+    repair_attempts: int
     result: str
+    columns: List[str]
+    rows: List[tuple]
+    row_count: int
+    page_size: Optional[int]
+    has_more: bool
+    next_cursor: Optional[str]
+    total_count: Optional[int]
+    elapsed_ms: float
+    query_id: Optional[str]
+    error: Optional[dict]
+    sql_error: Optional[str]
+    answer_mode: Optional[str]
     generation: str
+    answer_source: Optional[str]
+    answer_from_summary: bool
 
 
 class QueryOutput(TypedDict):
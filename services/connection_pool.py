@@ -0,0 +1,138 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 只讀連線的 SQLite 參數：以 mmap 直接讀取頁面並保留較大的頁面快取
+READ_MMAP_SIZE = int(os.environ.get("SQLITE_READ_MMAP_SIZE", str(256 * 1024 * 1024)))
+READ_CACHE_KIB = int(os.environ.get("SQLITE_READ_CACHE_KIB", "16384"))
+
+
+def _file_stamp(db_file):
+    stat = os.stat(db_file)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ReadConnectionPool:
+    """
+    Per-file pools of read-only SQLite connections.
+
+    Query endpoints used to open a fresh connection per call and pay the
+    connection setup plus a cold page cache every time. Connections here are
+    opened with a mode=ro URI and query_only, keep a tuned mmap_size and
+    cache_size, and are returned to the pool after each checkout. A file's pool
+    is recycled as soon as its inode, mtime or size changes, so a re-uploaded
+    database is never read through connections opened on the old file.
+
+    Callers must finish or close their cursors before the connection is
+    returned, so no read transaction is left open on an idle connection.
+
+    Attributes:
+        max_idle (int): Idle connections kept per file.
+        max_files (int): Number of files with pooled connections.
+        opened (int): Connections opened so far.
+        reused (int): Checkouts served by an idle connection.
+    """
+
+    def __init__(self, max_idle=4, max_files=16):
+        self.max_idle = max_idle
+        self.max_files = max_files
+        self.opened = 0
+        self.reused = 0
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _open(self, db_file):
+        conn = sqlite3.connect(
+            f"file:{os.path.abspath(db_file)}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {READ_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{READ_CACHE_KIB}")
+        return conn
+
+    @staticmethod
+    def _close_all(connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning("ReadConnectionPool: failed to close: %s", e)
+
+    @contextmanager
+    def connection(self, db_file):
+        """
+        Checks out a read-only connection to db_file for the duration of a block.
+
+        Raises:
+            OSError: If the database file does not exist.
+        """
+        key = os.path.abspath(db_file)
+        stamp = _file_stamp(key)
+        stale = []
+        conn = None
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and pool["stamp"] != stamp:
+                stale = pool["idle"]
+                pool = None
+            if pool is None:
+                pool = {"stamp": stamp, "idle": []}
+                self._pools[key] = pool
+                while len(self._pools) > self.max_files:
+                    _, evicted = self._pools.popitem(last=False)
+                    stale += evicted["idle"]
+            self._pools.move_to_end(key)
+            if pool["idle"]:
+                conn = pool["idle"].pop()
+                self.reused += 1
+        self._close_all(stale)
+
+        if conn is None:
+            conn = self._open(key)
+            with self._lock:
+                self.opened += 1
+
+        try:
+            yield conn
+        finally:
+            keep = False
+            with self._lock:
+                pool = self._pools.get(key)
+                if (
+                    pool is not None
+                    and pool["stamp"] == stamp
+                    and len(pool["idle"]) < self.max_idle
+                    and not conn.in_transaction
+                ):
+                    pool["idle"].append(conn)
+                    keep = True
+            if not keep:
+                self._close_all([conn])
+
+    def invalidate(self, db_file):
+        """Closes the idle connections of a file that was replaced"""
+        with self._lock:
+            pool = self._pools.pop(os.path.abspath(db_file), None)
+        if pool is not None:
+            self._close_all(pool["idle"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "files": len(self._pools),
+                "idle": sum(len(pool["idle"]) for pool in self._pools.values()),
+            }
+
+
+read_pool = ReadConnectionPool(
+    max_idle=int(os.environ.get("SQLITE_READ_POOL_SIZE", "4")),
+)
@@ -0,0 +1,885 @@
+import codecs
+import io
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from services.metrics import metrics
+from services.schema_index import build_schema_index
+
+logger = logging.getLogger(__name__)
+
+# 編碼偵測只讀取檔案開頭的固定大小樣本
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+
+# 常用漢字（繁簡），用來判斷 Big5 / GBK 解碼後的文字是否合理
+_COMMON_HANZI = set(
+    "的一是不了人我在有他這这個个們们中來来上大為为和國国地到以說说時时要就出會会"
+    "可也你對对生能而子那得於于著着下自之年過过發发後后作裡里用道行所然家種种事成方"
+    "多經经麼么去法學学如都同現现當当沒没動动面起看定天分還还進进好小部其些主樣样理"
+    "心她本前開开但因只從从想實实日者意無无力與与長长把機机十民第公此已工使情明性知"
+    "全三又關关點点正業业外將将兩两高間间由問问很最重並并物手應应向頭头文體体政美相"
+    "見见被利什二等產产或新己製制身果加西月話话合回特代內内信表化老給给世位次度門门"
+    "任常先海通教原東东聲声提立及比員员解水名真論论處处走義义各入口認认條条平系氣气"
+    "題题活更別别女變变四總总何電电數数安少報报才結结反受目太量再感建務务做接必場场"
+    "件計计管期市直資资命金指區区保至形社便空決决展科司五基書书非則则白界達达光放強"
+    "强即像難难且思王象完設设式色路記记南品住告類类求據据程北價价元台售銷销額额稱称"
+    "客戶户單单號号商店總总額额營营收支付費费率"
+)
+
+
+def _decode_sample(sample, encoding):
+    """Decodes a byte sample, tolerating a multibyte character cut at the end"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    return decoder.decode(sample, final=False)
+
+
+def _score_cjk(text, replacements):
+    """Scores decoded CJK text by common-character ratio and decoding errors"""
+    non_ascii = [ch for ch in text if ord(ch) > 127]
+    if not non_ascii:
+        return 0.0
+    hanzi = [ch for ch in non_ascii if "\u4e00" <= ch <= "\u9fff"]
+    common_ratio = sum(1 for ch in hanzi if ch in _COMMON_HANZI) / max(len(hanzi), 1)
+    # 非漢字、非全形標點的字元通常代表錯誤的解碼
+    odd = [
+        ch
+        for ch in non_ascii
+        if not ("\u4e00" <= ch <= "\u9fff")
+        and not ("\u3000" <= ch <= "\u303f")
+        and not ("\uff00" <= ch <= "\uffef")
+    ]
+    odd_ratio = len(odd) / len(non_ascii)
+    error_ratio = replacements / len(non_ascii)
+    score = (0.5 + 0.5 * min(1.0, common_ratio * 3)) * (1 - odd_ratio)
+    return max(0.0, score * (1 - min(1.0, error_ratio * 20)))
+
+
+def detect_encoding(csv_path, sample_size=ENCODING_SAMPLE_BYTES):
+    """
+    Detects a CSV file's encoding from a bounded byte sample.
+
+    UTF-8 is accepted when the sample decodes cleanly; Big5 and GBK are scored
+    by how many decoded characters are common hanzi and how few decoding errors
+    they produce; cp1252 and latin1 are low-confidence single-byte fallbacks.
+
+    Args:
+        csv_path (str): Path of the CSV file.
+        sample_size (int): Number of leading bytes to inspect.
+
+    Returns:
+        tuple: (encoding, confidence between 0 and 1, decoded sample text)
+    """
+    with open(csv_path, "rb") as f:
+        sample = f.read(sample_size)
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig", 1.0, _decode_sample(sample, "utf-8-sig")
+
+    try:
+        text = codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8", 1.0 if any(b > 127 for b in sample) else 0.99, text
+    except UnicodeDecodeError:
+        pass
+
+    candidates = []
+    for encoding in ["big5", "gbk"]:
+        text = _decode_sample(sample, encoding)
+        score = _score_cjk(text, text.count("\ufffd"))
+        candidates.append((score, encoding, text))
+
+    # cp1252 未定義的位元組出現時改用 latin1
+    undefined_cp1252 = {0x81, 0x8D, 0x8F, 0x90, 0x9D}
+    single_byte = "latin1" if undefined_cp1252 & set(sample) else "cp1252"
+    candidates.append((0.3, single_byte, _decode_sample(sample, single_byte)))
+
+    score, encoding, text = max(candidates, key=lambda c: c[0])
+    return encoding, round(score, 2), text
+
+
+# 超過此欄位數時改用分片存儲策略
+MAX_COLUMNS_SINGLE_TABLE = 1500
+MAX_COLUMNS_PER_SHARD = 1000
+
+# 分片表格共用的合成主鍵（CSV 行號），用來 JOIN 各個 _part_N 表格
+ROW_ID_COLUMN = "_row_id"
+
+# SQLite 預設的 SQLITE_MAX_COLUMN，也限制了 SELECT 結果的欄位數
+SQLITE_MAX_RESULT_COLUMNS = 2000
+
+# 匯入時的 SQLite 優化參數，以處理大文件和大量列數
+WRITE_PRAGMAS = [
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = 2000000",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA page_size = 65536",
+]
+
+
+def clean_identifier(name):
+    """Replaces characters that are awkward in SQL identifiers"""
+    cleaned = str(name).strip()
+    for old, new in [
+        (" ", "_"),
+        ("-", "_"),
+        ("(", "_"),
+        (")", "_"),
+        ("[", "_"),
+        ("]", "_"),
+        (".", "_"),
+        ("/", "_"),
+        ("\\", "_"),
+        ("'", ""),
+        ('"', ""),
+        ("&", "and"),
+        ("%", "percent"),
+        ("#", "num"),
+        ("@", "at"),
+        ("!", ""),
+        ("?", ""),
+    ]:
+        cleaned = cleaned.replace(old, new)
+    return cleaned
+
+
+def clean_column_names(columns):
+    """
+    Cleans CSV headers into unique, SQL-friendly column names.
+
+    Names that are empty or start with a digit are prefixed with col_<i>_, names
+    longer than 64 characters are truncated and duplicates get a numeric suffix.
+    """
+    cleaned_columns = []
+    for i, col in enumerate(columns):
+        cleaned_col = clean_identifier(col)
+
+        # 確保列名不是SQL關鍵字且以字母開頭
+        if not cleaned_col or cleaned_col[0].isdigit():
+            cleaned_col = f"col_{i}_{cleaned_col}"
+
+        # 限制列名長度
+        if len(cleaned_col) > 64:
+            cleaned_col = cleaned_col[:60] + f"_{i}"
+
+        # 確保列名唯一
+        base_col = cleaned_col
+        counter = 1
+        while cleaned_col in cleaned_columns:
+            cleaned_col = f"{base_col}_{counter}"
+            counter += 1
+            # 如果計數器讓列名過長，截短基礎名稱
+            if len(cleaned_col) > 64:
+                base_col = base_col[:50]
+                cleaned_col = f"{base_col}_{counter}"
+
+        cleaned_columns.append(cleaned_col)
+    return cleaned_columns
+
+
+def clean_table_name(csv_path):
+    """Derives a table name from the CSV file name"""
+    table_name = os.path.splitext(os.path.basename(csv_path))[0]
+    for old in [" ", "-", "(", ")", "[", "]", "."]:
+        table_name = table_name.replace(old, "_")
+    return table_name
+
+
+def choose_chunk_size(file_size, column_count):
+    """動態調整chunk_size基於文件大小和列數"""
+    wide = column_count > 1000
+    if file_size > 30 * 1024 * 1024:  # 大於30MB
+        return 2000 if wide else 3000
+    elif file_size > 10 * 1024 * 1024:  # 大於10MB
+        return 3000 if wide else 5000
+    return 5000 if wide else 10000
+
+
+# 欄位中至少有此比例的非空值可解析時，才視為數值或日期欄位
+TYPE_INFERENCE_THRESHOLD = 0.95
+
+# 超過此大小的整數轉成浮點數會失去精度（多為編號），保留為文字
+MAX_SAFE_INTEGER = 2**53
+
+# 依序嘗試的日期格式，(格式, 是否含時間)；只列出年份在前、不會與日/月順序混淆的格式
+DATE_FORMATS = [
+    ("%Y/%m/%d %H:%M:%S", True),
+    ("%Y-%m-%d %H:%M:%S", True),
+    ("%Y-%m-%dT%H:%M:%S", True),
+    ("%Y/%m/%d %H:%M", True),
+    ("%Y-%m-%d %H:%M", True),
+    ("%Y/%m/%d", False),
+    ("%Y-%m-%d", False),
+    ("%Y.%m.%d", False),
+]
+ISO_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ISO_DATE_FORMAT = "%Y-%m-%d"
+
+_THOUSANDS_RE = r"-?\d{1,3}(,\d{3})+(\.\d+)?"
+_LEADING_ZERO_RE = r"-?0\d+"
+# SQLite 的型別親和性會把符合此格式的文字改存為數值
+_NUMERIC_LITERAL_RE = r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?"
+
+
+def _non_blank(series):
+    """Returns the non-null, non-whitespace values of a string column"""
+    values = series.dropna()
+    return values[values.str.strip() != ""]
+
+
+def _to_number(series):
+    """Parses a string column as numbers, accepting thousands separators"""
+    cleaned = series.str.strip()
+    thousands = cleaned.str.fullmatch(_THOUSANDS_RE).fillna(False).astype(bool)
+    if thousands.any():
+        cleaned = cleaned.where(~thousands, cleaned.str.replace(",", "", regex=False))
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def infer_column_type(series):
+    """
+    Infers the storage type of a CSV column from a sample of its raw strings.
+
+    A column is numeric or a date when at least TYPE_INFERENCE_THRESHOLD of its
+    non-blank values parse, so a few bad cells no longer turn the whole column
+    into TEXT. Values with leading zeros and integers too large for a float are
+    kept as TEXT since they are usually codes or identifiers.
+
+    Returns:
+        dict: {"type": SQLite declared type, "format": date format or None}
+    """
+    values = _non_blank(series)
+    if values.empty:
+        return {"type": "TEXT", "format": None}
+
+    numbers = _to_number(values)
+    if numbers.notna().mean() >= TYPE_INFERENCE_THRESHOLD:
+        parsed = numbers.dropna()
+        if values.str.strip().str.fullmatch(_LEADING_ZERO_RE).any():
+            return {"type": "TEXT", "format": None}
+        if (parsed % 1 == 0).all():
+            if parsed.abs().max() >= MAX_SAFE_INTEGER:
+                return {"type": "TEXT", "format": None}
+            return {"type": "INTEGER", "format": None}
+        return {"type": "REAL", "format": None}
+
+    stripped = values.str.strip()
+    for date_format, has_time in DATE_FORMATS:
+        parsed = pd.to_datetime(stripped, format=date_format, errors="coerce")
+        if parsed.notna().mean() >= TYPE_INFERENCE_THRESHOLD:
+            return {"type": "DATETIME" if has_time else "DATE", "format": date_format}
+    return {"type": "TEXT", "format": None}
+
+
+def convert_column(series, column_type):
+    """
+    Converts a raw string column to its inferred type.
+
+    Numbers become int/float values and dates become ISO strings, which sort
+    and compare correctly as text. Cells that do not parse keep their raw
+    string, which SQLite stores as TEXT whatever the declared type. Some raw
+    values would still be rewritten by SQLite's type affinity, such as codes
+    with leading zeros or integers too large for a float; those are reported so
+    the caller can widen the column to TEXT.
+
+    Returns:
+        tuple: (converted Series, number of non-blank cells kept as raw text,
+        whether the column must be widened to TEXT)
+    """
+    if column_type["type"] == "TEXT":
+        return series, 0, False
+
+    stripped = series.str.strip()
+    non_blank = series.notna() & (stripped != "")
+    if column_type["format"] is None:
+        converted = _to_number(series)
+        needs_text = stripped.str.fullmatch(_LEADING_ZERO_RE).fillna(False).any()
+        if column_type["type"] == "INTEGER":
+            needs_text = needs_text or (converted.abs() >= MAX_SAFE_INTEGER).any()
+    else:
+        if column_type["type"] == "DATETIME":
+            output_format = ISO_DATETIME_FORMAT
+        else:
+            output_format = ISO_DATE_FORMAT
+        parsed = pd.to_datetime(stripped, format=column_type["format"], errors="coerce")
+        converted = parsed.dt.strftime(output_format)
+        needs_text = False
+
+    failed = non_blank & converted.isna()
+    if failed.any():
+        needs_text = (
+            needs_text
+            or stripped[failed].str.fullmatch(_NUMERIC_LITERAL_RE).fillna(False).any()
+        )
+        converted = converted.astype(object).where(~failed, series)
+    return converted, int(failed.sum()), bool(needs_text)
+
+
+def open_write_connection(db_path):
+    """Opens an autocommit connection tuned for bulk loading"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in WRITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def create_table(conn, table_name, columns, types):
+    """Replaces a table and returns the prepared INSERT statement for it"""
+    column_defs = ", ".join(
+        f'"{col}" {col_type}' for col, col_type in zip(columns, types)
+    )
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(f'CREATE TABLE "{table_name}" ({column_defs})')
+    placeholders = ", ".join("?" * len(columns))
+    return f'INSERT INTO "{table_name}" VALUES ({placeholders})'
+
+
+def chunk_rows(chunk):
+    """Converts a DataFrame chunk into plain Python tuples with NULLs for NaN"""
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+class TableWriter:
+    """
+    Writes a slice of a CSV file's columns into one freshly created table.
+
+    Column types are inferred from the first chunk it is created with. Later
+    cells that do not parse are stored as their raw text, and a column is
+    widened to TEXT in place when a later chunk holds values SQLite would
+    otherwise rewrite, so no cell is lost. With with_row_id, a synthetic
+    _row_id INTEGER PRIMARY KEY holding the CSV row number is prepended; shard
+    tables also declare it as referencing the main table's _row_id, so the join
+    key shows up in the schema the agent sees.
+
+    Attributes:
+        table_name (str): Name of the table being written.
+        positions (list): Positions of the CSV columns stored in this table.
+        rows_written (int): Number of rows inserted so far.
+        report (list): Inferred schema report, one dict per column with the
+            final type, the number of cells kept as raw text ("unparsed") and
+            whether the column was widened to TEXT ("widened").
+    """
+
+    def __init__(
+        self,
+        conn,
+        table_name,
+        first_chunk,
+        positions,
+        columns,
+        with_row_id=False,
+        parent_table=None,
+    ):
+        self.table_name = table_name
+        self.positions = list(positions)
+        self.rows_written = 0
+        self._conn = conn
+        self._with_row_id = with_row_id
+        self._column_types = [
+            infer_column_type(first_chunk.iloc[:, position])
+            for position in self.positions
+        ]
+        self.report = [
+            {
+                "column": column,
+                "source": str(first_chunk.columns[position]),
+                "type": column_type["type"],
+                "unparsed": 0,
+                "widened": False,
+            }
+            for column, position, column_type in zip(
+                columns, self.positions, self._column_types
+            )
+        ]
+
+        self._names = list(columns)
+        self._key_columns = []
+        if with_row_id:
+            key_type = "INTEGER PRIMARY KEY"
+            if parent_table:
+                key_type += f' REFERENCES "{parent_table}" ("{ROW_ID_COLUMN}")'
+            self._key_columns = [(ROW_ID_COLUMN, key_type)]
+        self.insert_sql = create_table(conn, table_name, *self._column_defs())
+
+    def _column_defs(self):
+        names = [name for name, _ in self._key_columns] + self._names
+        types = [key_type for _, key_type in self._key_columns] + [
+            column_type["type"] for column_type in self._column_types
+        ]
+        return names, types
+
+    def _widen_to_text(self, indexes):
+        """Rebuilds the table with the given columns declared as TEXT"""
+        for i in indexes:
+            self._column_types[i] = {"type": "TEXT", "format": None}
+            self.report[i]["type"] = "TEXT"
+            self.report[i]["widened"] = True
+        widened = {self._names[i] for i in indexes}
+        logger.info(
+            "表格 %s 的欄位 %s 出現無法保留原值的資料，改存為 TEXT",
+            self.table_name,
+            ", ".join(sorted(widened)),
+        )
+
+        # 已寫入的數值以 CAST 轉成文字，之後的 chunk 直接寫入原始字串
+        names, types = self._column_defs()
+        select_list = ", ".join(
+            f'CAST("{name}" AS TEXT)' if name in widened else f'"{name}"'
+            for name in names
+        )
+        rebuilt = f"{self.table_name}__widen"
+        create_table(self._conn, rebuilt, names, types)
+        self._conn.execute(
+            f'INSERT INTO "{rebuilt}" SELECT {select_list} FROM "{self.table_name}"'
+        )
+        self._conn.execute(f'DROP TABLE "{self.table_name}"')
+        self._conn.execute(f'ALTER TABLE "{rebuilt}" RENAME TO "{self.table_name}"')
+
+    def write(self, chunk):
+        """Converts this table's columns of a chunk and bulk-inserts them"""
+        converted = {}
+        if self._with_row_id:
+            # chunk 的索引是整份文件中的行號，所有分片得到相同的 row id
+            converted[ROW_ID_COLUMN] = pd.Series(chunk.index + 1, index=chunk.index)
+        widen = []
+        for i, column_type in enumerate(self._column_types):
+            converted[i], unparsed, needs_text = convert_column(
+                chunk.iloc[:, self.positions[i]], column_type
+            )
+            if needs_text:
+                widen.append(i)
+                converted[i] = chunk.iloc[:, self.positions[i]]
+            else:
+                self.report[i]["unparsed"] += unparsed
+        if widen:
+            self._widen_to_text(widen)
+        self._conn.executemany(self.insert_sql, chunk_rows(pd.DataFrame(converted)))
+        self.rows_written += len(chunk)
+
+
+def stream_csv_tables(
+    conn, csv_path, encoding, chunk_size, make_writers, progress=None
+):
+    """
+    Parses a CSV once and fans every chunk out to one or more TableWriters.
+
+    Each chunk is parsed, handed to every writer and dropped before the next one
+    is read, so peak memory is bounded by the chunk size rather than the file
+    size. Cells are read as strings and each writer infers its column types
+    once from the first chunk, so every chunk is converted the same way instead
+    of relying on pandas' per-chunk dtype guesses. All tables are written in a
+    single transaction.
+
+    Args:
+        conn (sqlite3.Connection): Autocommit connection from open_write_connection.
+        csv_path (str): Path of the CSV file.
+        encoding (str): Text encoding of the CSV file.
+        chunk_size (int): Rows parsed and inserted per batch.
+        make_writers (callable): Called with the first chunk, returns the
+            list of TableWriters to feed.
+        progress (JobProgress): Optional progress handle.
+
+    Returns:
+        list: The TableWriters, after every row has been written.
+
+    Raises:
+        ValueError: If the CSV has no data rows.
+    """
+    start = time.perf_counter()
+    rows_read = 0
+    writers = None
+
+    conn.execute("BEGIN")
+    try:
+        with open(csv_path, "rb") as csv_file:
+            # 無效位元組在串流時直接替換，不會因為半途解碼失敗而重新解析整份文件
+            for chunk in pd.read_csv(
+                csv_file,
+                encoding=encoding,
+                encoding_errors="replace",
+                chunksize=chunk_size,
+                dtype=str,
+            ):
+                if writers is None:
+                    writers = make_writers(chunk)
+                if chunk.empty:
+                    continue
+
+                for writer in writers:
+                    writer.write(chunk)
+                rows_read += len(chunk)
+                del chunk
+
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    progress.update(
+                        rows=rows_read,
+                        bytes_read=csv_file.tell(),
+                        rows_per_sec=round(rows_read / elapsed) if elapsed else 0,
+                    )
+
+        if writers is None or rows_read == 0:
+            raise ValueError("CSV文件沒有數據")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "已寫入表格 %s: %d 行，耗時 %.2f 秒 (%.0f 行/秒)",
+        ", ".join(writer.table_name for writer in writers),
+        rows_read,
+        elapsed,
+        rows_read / elapsed if elapsed else 0,
+    )
+    metrics.inc("csv_ingest_rows_total", rows_read)
+    metrics.observe("csv_ingest_rows_per_second", rows_read / elapsed if elapsed else 0)
+    for writer in writers:
+        log_schema_report(writer.table_name, writer.report)
+    return writers
+
+
+def write_csv_table(conn, csv_path, table_name, encoding, chunk_size, progress=None):
+    """
+    Streams every column of a CSV into a single freshly created table.
+
+    Returns:
+        tuple: (number of rows inserted, inferred schema report as a list of
+        {"column", "source", "type", "unparsed", "widened"} dicts)
+    """
+
+    def make_writers(chunk):
+        columns = clean_column_names(chunk.columns)
+        return [TableWriter(conn, table_name, chunk, range(len(columns)), columns)]
+
+    (writer,) = stream_csv_tables(
+        conn, csv_path, encoding, chunk_size, make_writers, progress=progress
+    )
+    return writer.rows_written, writer.report
+
+
+def create_row_id_view(conn, base_table_name, writers):
+    """
+    Creates a view joining every shard table on _row_id.
+
+    SQLite limits a result set to SQLITE_MAX_RESULT_COLUMNS columns, so the
+    view is only created when all shard columns fit; otherwise queries join the
+    _part_N tables on _row_id themselves.
+
+    Returns:
+        str: The view name, or None when it was not created.
+    """
+    column_count = 1 + sum(len(writer.positions) for writer in writers)
+    if column_count > SQLITE_MAX_RESULT_COLUMNS:
+        logger.info(
+            "共 %d 個欄位超過 SQLite 結果欄位上限，不建立合併檢視表", column_count
+        )
+        return None
+
+    view_name = f"{base_table_name}_all"
+    select_list = [f'"{base_table_name}"."{ROW_ID_COLUMN}"']
+    for writer in writers:
+        select_list += [
+            f'"{writer.table_name}"."{column["column"]}"' for column in writer.report
+        ]
+    joins = "".join(
+        f' JOIN "{writer.table_name}" USING ("{ROW_ID_COLUMN}")'
+        for writer in writers[1:]
+    )
+    try:
+        conn.execute(f'DROP VIEW IF EXISTS "{view_name}"')
+        conn.execute(
+            f'CREATE VIEW "{view_name}" AS SELECT {", ".join(select_list)} '
+            f'FROM "{base_table_name}"{joins}'
+        )
+    except sqlite3.Error as e:
+        logger.warning("建立合併檢視表失敗: %s", e)
+        return None
+    return view_name
+
+
+def conversion_stats(reports):
+    """Totals the cells kept as raw text and the widened columns of schema reports"""
+    return {
+        "unparsed_cells": sum(column["unparsed"] for r in reports for column in r),
+        "widened_columns": [
+            column["column"] for r in reports for column in r if column["widened"]
+        ],
+    }
+
+
+def log_schema_report(table_name, report):
+    """Logs the inferred column types and how many cells failed to convert"""
+    counts = {}
+    for column in report:
+        counts[column["type"]] = counts.get(column["type"], 0) + 1
+    logger.info(
+        "表格 %s 推斷欄位型別: %s",
+        table_name,
+        ", ".join(f"{t} {n} 欄" for t, n in sorted(counts.items())),
+    )
+    for column in report:
+        if column["unparsed"]:
+            logger.info(
+                "欄位 %s (%s) 有 %d 個無法轉換的值以原始文字保存",
+                column["column"],
+                column["type"],
+                column["unparsed"],
+            )
+
+
+def index_database_schema(db_path):
+    """在匯入時建立欄位檢索索引，供 SQL Agent 剪枝 schema 使用"""
+    try:
+        build_schema_index(db_path)
+    except Exception as e:
+        # 索引失敗不影響上傳，SQL Agent 會在第一次查詢時重建
+        logger.warning("建立 schema 索引失敗: %s", e)
+
+
+def convert_csv_to_sqlite(csv_path, db_path, progress=None):
+    """
+    將CSV文件轉換為SQLite資料庫，progress 用於回報背景匯入進度，並記錄匯入耗時
+    成功時回傳 (True, 匯入摘要)，摘要包含 table_name、encoding、encoding_confidence、
+    以原始文字保存的儲存格數 unparsed_cells 與改存為 TEXT 的欄位 widened_columns；
+    失敗時回傳 (False, 錯誤訊息)
+    """
+    start = time.monotonic()
+    success, result = _convert_csv_to_sqlite(csv_path, db_path, progress=progress)
+    elapsed = time.monotonic() - start
+    metrics.inc("csv_ingest_jobs_total", outcome="succeeded" if success else "failed")
+    metrics.observe("csv_ingest_seconds", elapsed)
+    if success:
+        metrics.inc("csv_ingest_bytes_total", os.path.getsize(csv_path))
+    return success, result
+
+
+def _with_summary(outcome, summary):
+    """把編碼等匯入摘要合併進分片轉換成功時回傳的結果"""
+    success, result = outcome
+    if not success:
+        return outcome
+    return True, dict(summary, **result)
+
+
+def _convert_csv_to_sqlite(csv_path, db_path, progress=None):
+    try:
+        file_size = os.path.getsize(csv_path)
+        table_name = clean_table_name(csv_path)
+
+        # 只讀取一次固定大小的樣本來偵測編碼，不再逐一嘗試整份文件
+        encoding, confidence, sample_text = detect_encoding(csv_path)
+        # 偵測到的編碼放進匯入摘要，沒有 progress 的呼叫端也能取得
+        summary = {"encoding": encoding, "encoding_confidence": confidence}
+        if progress:
+            progress.update(**summary)
+
+        try:
+            # 先讀取前5行來檢查列數和結構
+            sample_df = pd.read_csv(io.StringIO(sample_text), nrows=5)
+        except Exception as e:
+            return False, f"無法讀取CSV文件，請檢查文件格式和編碼。錯誤詳情: {e}"
+        if sample_df.empty:
+            return False, "無法讀取CSV文件，請檢查文件格式和編碼"
+
+        column_count = len(sample_df.columns)
+        logger.info(
+            "偵測到 %s 編碼 (信心 %.2f)，檢測到 %d 個欄位",
+            encoding,
+            confidence,
+            column_count,
+        )
+
+        # 檢查列數是否過多，如果超過1500列，則採用分片存儲策略
+        if column_count > MAX_COLUMNS_SINGLE_TABLE:
+            logger.warning("CSV文件有 %d 個欄位，將採用分片存儲策略", column_count)
+            return _with_summary(
+                convert_csv_to_sqlite_chunked(
+                    csv_path, db_path, encoding, progress=progress
+                ),
+                summary,
+            )
+
+        chunk_size = choose_chunk_size(file_size, column_count)
+        logger.info(
+            "文件大小: %.2fMB，使用chunk_size: %d",
+            file_size / (1024 * 1024),
+            chunk_size,
+        )
+        if progress:
+            progress.update(phase="writing", rows=0, bytes_read=0)
+
+        conn = open_write_connection(db_path)
+        try:
+            _, report = write_csv_table(
+                conn, csv_path, table_name, encoding, chunk_size, progress=progress
+            )
+            if progress:
+                progress.update(schema_report={table_name: report})
+
+            # 驗證數據是否成功插入
+            (row_count,) = conn.execute(
+                f'SELECT COUNT(*) FROM "{table_name}"'
+            ).fetchone()
+            actual_columns = conn.execute(
+                f'PRAGMA table_info("{table_name}")'
+            ).fetchall()
+        except sqlite3.Error as sql_error:
+            logger.error("SQLite寫入錯誤: %s", sql_error)
+            error_msg = str(sql_error)
+
+            if "too many columns" in error_msg.lower():
+                logger.info("嘗試使用分片存儲策略...")
+                return _with_summary(
+                    convert_csv_to_sqlite_chunked(
+                        csv_path, db_path, encoding, progress=progress
+                    ),
+                    summary,
+                )
+            elif "database is locked" in error_msg.lower():
+                return False, f"數據庫被鎖定，請稍後重試。錯誤詳情: {error_msg}"
+            else:
+                return False, f"數據庫寫入失敗: {error_msg}"
+        finally:
+            conn.close()
+
+        logger.info(
+            "CSV文件已成功轉換為SQLite，表格名稱: %s，共 %d 行數據，%d 列",
+            table_name,
+            row_count,
+            len(actual_columns),
+        )
+        if progress:
+            progress.update(phase="indexing")
+        index_database_schema(db_path)
+        return True, dict(summary, table_name=table_name, **conversion_stats([report]))
+
+    except Exception as e:
+        logger.error("CSV轉換錯誤: %s", e)
+        # 提供更詳細的錯誤信息
+        error_msg = str(e)
+        if "too many columns" in error_msg.lower():
+            return (
+                False,
+                f"CSV文件欄位數量過多。SQLite 在處理大量欄位時有限制，建議：1) 減少欄位數量 2) 將數據分割為多個文件。錯誤詳情: {error_msg}",
+            )
+        elif "memory" in error_msg.lower() or "out of memory" in error_msg.lower():
+            return (
+                False,
+                f"文件過大導致記憶體不足。建議：1) 減少文件大小到30MB以下 2) 移除不需要的欄位。錯誤詳情: {error_msg}",
+            )
+        elif "encoding" in error_msg.lower():
+            return False, f"文件編碼問題，請檢查文件編碼格式。錯誤詳情: {error_msg}"
+        elif "disk space" in error_msg.lower() or "no space" in error_msg.lower():
+            return False, f"磁盤空間不足，請清理磁盤空間後重試。錯誤詳情: {error_msg}"
+        else:
+            return False, f"CSV轉換失敗: {error_msg}"
+
+
+def convert_csv_to_sqlite_chunked(csv_path, db_path, encoding, progress=None):
+    """
+    使用分片策略處理超大列數的CSV文件
+    只解析一次文件，把每個 chunk 的欄位切片分送給各分片表格寫入；
+    每個分片都有相同的 _row_id 主鍵，可用來 JOIN 各個 _part_N 表格
+    """
+    try:
+        logger.info("開始使用分片存儲策略處理超大列數CSV文件...")
+
+        # 只讀取CSV文件頭部來決定 chunk 大小
+        header = pd.read_csv(
+            csv_path, encoding=encoding, encoding_errors="replace", nrows=0
+        )
+        total_columns = len(header.columns)
+        base_table_name = clean_table_name(csv_path)
+        read_chunk_size = choose_chunk_size(os.path.getsize(csv_path), total_columns)
+
+        def make_writers(chunk):
+            columns = clean_column_names(chunk.columns)
+            # 避免與合成的主鍵欄位同名
+            columns = [
+                f"{column}_csv" if column == ROW_ID_COLUMN else column
+                for column in columns
+            ]
+            num_shards = (
+                len(columns) + MAX_COLUMNS_PER_SHARD - 1
+            ) // MAX_COLUMNS_PER_SHARD
+            logger.info(
+                "將 %d 列分成 %d 個分片，每片最多 %d 列",
+                len(columns),
+                num_shards,
+                MAX_COLUMNS_PER_SHARD,
+            )
+
+            writers = []
+            for shard_idx in range(num_shards):
+                positions = range(
+                    shard_idx * MAX_COLUMNS_PER_SHARD,
+                    min((shard_idx + 1) * MAX_COLUMNS_PER_SHARD, len(columns)),
+                )
+                table_name = (
+                    base_table_name
+                    if shard_idx == 0
+                    else f"{base_table_name}_part_{shard_idx + 1}"
+                )
+                writers.append(
+                    TableWriter(
+                        conn,
+                        table_name,
+                        chunk,
+                        positions,
+                        [columns[p] for p in positions],
+                        with_row_id=True,
+                        parent_table=base_table_name if shard_idx else None,
+                    )
+                )
+            return writers
+
+        if progress:
+            progress.update(phase="writing", rows=0, bytes_read=0)
+
+        conn = open_write_connection(db_path)
+        try:
+            writers = stream_csv_tables(
+                conn,
+                csv_path,
+                encoding,
+                read_chunk_size,
+                make_writers,
+                progress=progress,
+            )
+            view_name = create_row_id_view(conn, base_table_name, writers)
+        finally:
+            conn.close()
+
+        tables = [writer.table_name for writer in writers]
+        if progress:
+            progress.update(
+                schema_report={writer.table_name: writer.report for writer in writers}
+            )
+
+        result_message = f"CSV文件已成功轉換為SQLite，創建了 {len(tables)} 個表格。主表格: {tables[0]}"
+        if len(tables) > 1:
+            result_message += f"，其他表格: {', '.join(tables[1:])}"
+        result_message += f"，各表格以 {ROW_ID_COLUMN} 欄位 JOIN"
+        if view_name:
+            result_message += f"，合併檢視表: {view_name}"
+        logger.info(result_message)
+
+        if progress:
+            progress.update(phase="indexing")
+        index_database_schema(db_path)
+        return True, dict(
+            table_name=tables[0],
+            **conversion_stats([writer.report for writer in writers]),
+        )
+
+    except Exception as e:
+        logger.error("分片處理錯誤: %s", e)
+        return False, f"分片處理失敗: {str(e)}"
@@ -0,0 +1,635 @@
+import atexit
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from services.connection_pool import read_pool
+from services.query_budget import DEFAULT_TIMEOUT_MS, QueryBudget
+from services.result_cache import normalize_sql
+
+logger = logging.getLogger(__name__)
+
+# 顧問建立的索引名稱前綴，用來與使用者自己的索引區分
+INDEX_PREFIX = "idx_advisor_"
+
+# 覆蓋索引最多包含的欄位數，超過時只索引篩選欄位
+MAX_INDEX_COLUMNS = 6
+
+# 查詢紀錄最多保留的語句數與每次分析檢查的語句數
+MAX_LOGGED_QUERIES = 500
+MAX_ANALYZED_QUERIES = 200
+
+# 量測前後耗時時每個查詢最多讀取的筆數與每次執行的時間上限
+TIMING_MAX_ROWS = 10000
+TIMING_TIMEOUT_MS = DEFAULT_TIMEOUT_MS
+
+# 查詢紀錄先累積在記憶體中，每隔此秒數由背景執行緒批次寫入
+FLUSH_INTERVAL = 5.0
+
+_SCAN_RE = re.compile(
+    r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?(.*)$", re.I
+)
+_AUTOMATIC_INDEX_RE = re.compile(r"AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.*)\)")
+_TABLE_ALIAS_RE = re.compile(
+    r'\b(?:FROM|JOIN)\s+("?)([\w]+)\1(?:\s+(?:AS\s+)?("?)([\w]+)\3)?', re.I
+)
+_PREDICATE_RE = re.compile(
+    r"\b(?:WHERE|ON)\b(.*?)(?=\b(?:GROUP\s+BY|ORDER\s+BY|LIMIT|HAVING|UNION|"
+    r"INTERSECT|EXCEPT|WINDOW|JOIN|LEFT|RIGHT|INNER|CROSS|FULL)\b|$)",
+    re.I | re.S,
+)
+_GROUP_BY_RE = re.compile(
+    r"\bGROUP\s+BY\b(.*?)(?=\b(?:HAVING|ORDER\s+BY|LIMIT|UNION|WINDOW)\b|$)",
+    re.I | re.S,
+)
+_SQL_KEYWORDS = {
+    "where",
+    "on",
+    "join",
+    "left",
+    "right",
+    "inner",
+    "cross",
+    "full",
+    "outer",
+    "natural",
+    "group",
+    "order",
+    "limit",
+    "using",
+    "union",
+    "having",
+    "window",
+}
+
+
+def query_log_path(db_file):
+    """Returns the side file that stores the query log of a database"""
+    return f"{db_file}.querylog"
+
+
+def _column_pattern(column, qualifiers):
+    """Matches a column reference, optionally qualified by a table or alias"""
+    names = "|".join(re.escape(q) for q in qualifiers)
+    return (
+        rf'(?<![\w"])(?:(?:"?(?:{names})"?)\.)?'
+        rf'(?:"{re.escape(column)}"|{re.escape(column)})(?![\w"])'
+    )
+
+
+def _classify_columns(query, table, aliases, table_columns):
+    """
+    Splits a table's columns into equality, range and GROUP BY columns.
+
+    This is a lexical heuristic over the WHERE / ON / GROUP BY clauses; the
+    query plan decides which tables need an index, this only decides the order
+    of the index key.
+    """
+    predicates = " ".join(_PREDICATE_RE.findall(query))
+    group_by = " ".join(_GROUP_BY_RE.findall(query))
+    qualifiers = [table] + aliases
+
+    equality, ranges, grouped = [], [], []
+    for column in table_columns:
+        pattern = _column_pattern(column, qualifiers)
+        if re.search(pattern + r"\s*(?:==?|\bIN\b|\bIS\b)", predicates, re.I) or (
+            re.search(r"(?<![<>!])==?\s*" + pattern, predicates, re.I)
+        ):
+            equality.append(column)
+        elif re.search(
+            pattern + r"\s*(?:<=|>=|<|>|\bBETWEEN\b|\bLIKE\b|\bGLOB\b)",
+            predicates,
+            re.I,
+        ):
+            ranges.append(column)
+        if group_by and re.search(pattern, group_by, re.I):
+            grouped.append(column)
+    return equality, ranges, grouped
+
+
+class IndexAdvisor:
+    """
+    Recommends and creates covering indexes from the log of executed queries.
+
+    Uploaded tables have no indexes, so every filter, join and GROUP BY the
+    agent generates scans the whole table. execute_sql records each read-only
+    statement it executes (both /api/sql_query and the SQLAgent execute node go
+    through it); executions are aggregated in memory and a background thread
+    writes them every flush_interval seconds, in one transaction per database,
+    to a per-database side file shared by all gunicorn workers. advise()
+    replays the logged statements through EXPLAIN QUERY PLAN, finds tables
+    that are scanned or get a transient automatic index, and proposes
+    an index keyed on the equality, GROUP BY and range columns, extended with
+    the other columns the queries read when that keeps it small enough to be
+    covering. apply() creates them within a count and disk size budget and
+    times the motivating queries before and after on pooled read-only
+    connections, each run bounded by a QueryBudget.
+
+    Attributes:
+        mode (str): "off" records nothing, "suggest" only recommends and
+            "auto" also creates indexes in the background.
+        max_indexes (int): Maximum number of advisor indexes per database.
+        max_bytes (int): Maximum total disk size of advisor indexes.
+        min_executions (int): Executions a candidate needs to be recommended.
+        flush_interval (float): Seconds between writes of buffered executions.
+    """
+
+    def __init__(
+        self,
+        mode="suggest",
+        max_indexes=8,
+        max_bytes=256 * 1024 * 1024,
+        min_executions=3,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        self.mode = mode
+        self.max_indexes = max_indexes
+        self.max_bytes = max_bytes
+        self.min_executions = min_executions
+        self.flush_interval = flush_interval
+        self._running = set()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flusher_pid = None
+
+    def _connect_log(self, db_file):
+        conn = sqlite3.connect(query_log_path(db_file), timeout=5)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_log ("
+            "digest TEXT PRIMARY KEY, query TEXT, executions INTEGER, "
+            "total_ms REAL, last_seen REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS advisor_indexes ("
+            "name TEXT PRIMARY KEY, table_name TEXT, columns TEXT, "
+            "size_bytes INTEGER, before_ms REAL, after_ms REAL, created_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rejected_indexes ("
+            "name TEXT PRIMARY KEY, before_ms REAL, after_ms REAL, rejected_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        return conn
+
+    def record(self, db_file, query, elapsed_ms):
+        """Buffers one execution of a read-only statement against db_file"""
+        if self.mode == "off":
+            return
+        normalized = normalize_sql(query)
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._pending_lock:
+            entries = self._pending.setdefault(os.path.abspath(db_file), {})
+            entry = entries.get(digest)
+            if entry is None:
+                entries[digest] = [normalized, 1, elapsed_ms, now]
+            else:
+                entry[1] += 1
+                entry[2] += elapsed_ms
+                entry[3] = now
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # gunicorn 會 fork worker，因此在每個程序第一次記錄時才啟動寫入執行緒
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._pending_lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        flusher = threading.Thread(
+            target=self._flush_loop, name="index-advisor-log", daemon=True
+        )
+        flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self, db_file=None):
+        """Writes buffered executions to the query logs, of db_file or of all"""
+        with self._pending_lock:
+            if db_file is None:
+                batches, self._pending = self._pending, {}
+            else:
+                key = os.path.abspath(db_file)
+                entries = self._pending.pop(key, None)
+                batches = {key: entries} if entries else {}
+        for path, entries in batches.items():
+            self._write_log(path, entries)
+
+    def _write_log(self, db_file, entries):
+        executions = sum(entry[1] for entry in entries.values())
+        try:
+            with closing(self._connect_log(db_file)) as conn, conn:
+                conn.executemany(
+                    "INSERT INTO query_log VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(digest) DO UPDATE SET "
+                    "executions = executions + excluded.executions, "
+                    "total_ms = total_ms + excluded.total_ms, "
+                    "last_seen = max(last_seen, excluded.last_seen)",
+                    [(digest, *entry) for digest, entry in entries.items()],
+                )
+                conn.execute(
+                    "DELETE FROM query_log WHERE digest IN (SELECT digest FROM "
+                    "query_log ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                    (MAX_LOGGED_QUERIES,),
+                )
+                conn.execute(
+                    "INSERT INTO stats VALUES ('pending', ?) ON CONFLICT(name) "
+                    "DO UPDATE SET value = value + excluded.value",
+                    (executions,),
+                )
+                pending = conn.execute(
+                    "SELECT value FROM stats WHERE name = 'pending'"
+                ).fetchone()[0]
+                if self.mode == "auto" and pending >= self.min_executions:
+                    conn.execute("UPDATE stats SET value = 0 WHERE name = 'pending'")
+                else:
+                    pending = 0
+        except sqlite3.Error as e:
+            logger.warning("IndexAdvisor: failed to record queries: %s", e)
+            return
+
+        if pending:
+            self._apply_in_background(db_file)
+
+    def _apply_in_background(self, db_file):
+        key = os.path.abspath(db_file)
+        with self._lock:
+            if key in self._running:
+                return
+            self._running.add(key)
+
+        def run():
+            try:
+                for result in self.apply(db_file):
+                    logger.info("IndexAdvisor: %s", result)
+            except Exception as e:
+                logger.warning("IndexAdvisor: automatic indexing failed: %s", e)
+            finally:
+                with self._lock:
+                    self._running.discard(key)
+
+        threading.Thread(target=run, name="index-advisor", daemon=True).start()
+
+    def _logged_queries(self, db_file):
+        if not os.path.exists(query_log_path(db_file)):
+            return []
+        with closing(self._connect_log(db_file)) as conn:
+            return conn.execute(
+                "SELECT query, executions, total_ms FROM query_log "
+                "ORDER BY executions * total_ms DESC LIMIT ?",
+                (MAX_ANALYZED_QUERIES,),
+            ).fetchall()
+
+    def _rejected(self, db_file):
+        if not os.path.exists(query_log_path(db_file)):
+            return set()
+        with closing(self._connect_log(db_file)) as conn:
+            return {row[0] for row in conn.execute("SELECT name FROM rejected_indexes")}
+
+    @staticmethod
+    def _existing_index_keys(conn, table):
+        keys = []
+        for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            info = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()
+            keys.append([row[2] for row in sorted(info)])
+        return keys
+
+    def _candidates(self, conn, query):
+        """Returns (table, key columns, read columns) for tables the plan scans"""
+        reads = {}
+
+        def authorizer(action, arg1, arg2, db_name, trigger):
+            if action == sqlite3.SQLITE_READ and arg1 and arg2:
+                reads.setdefault(arg1, set()).add(arg2)
+            return sqlite3.SQLITE_OK
+
+        conn.set_authorizer(authorizer)
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        finally:
+            conn.set_authorizer(None)
+
+        aliases = {}
+        for _, table, _, alias in _TABLE_ALIAS_RE.findall(query):
+            aliases.setdefault(table, [])
+            if alias and alias.lower() not in _SQL_KEYWORDS:
+                aliases[table].append(alias)
+        tables_by_name = {name.lower(): name for name in reads}
+        for table, names in aliases.items():
+            for name in names:
+                tables_by_name.setdefault(name.lower(), table)
+
+        candidates = []
+        for row in plan:
+            match = _SCAN_RE.match(row[3])
+            if not match:
+                continue
+            operation, name, alias, rest = match.groups()
+            table = tables_by_name.get((alias or name).lower()) or tables_by_name.get(
+                name.lower()
+            )
+            if table is None or table not in reads:
+                continue
+
+            automatic = _AUTOMATIC_INDEX_RE.search(rest)
+            if operation.upper() == "SEARCH" and not automatic:
+                continue
+
+            table_columns = [
+                col[1] for col in conn.execute(f'PRAGMA table_info("{table}")')
+            ]
+            equality, ranges, grouped = _classify_columns(
+                query, table, aliases.get(table, []), table_columns
+            )
+            if automatic:
+                for term in automatic.group(1).split(" AND "):
+                    column = term.split("=")[0].strip().strip('"')
+                    if column in table_columns and column not in equality:
+                        equality.append(column)
+
+            key = equality + [c for c in grouped if c not in equality]
+            key += [c for c in ranges if c not in key][:1]
+            if not key:
+                continue
+            candidates.append((table, key, sorted(reads[table])))
+        return candidates
+
+    def advise(self, db_file):
+        """
+        Recommends indexes for the tables that logged queries scan repeatedly.
+
+        Returns:
+            list: Dicts with "name", "table", "columns", "key_columns",
+            "executions", "total_ms" and a few sample "queries", best first.
+        """
+        # 先寫入本程序尚未寫出的紀錄，其他 worker 的紀錄最多延遲 flush_interval 秒
+        self.flush(db_file)
+        recommendations = {}
+        with closing(
+            sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+        ) as conn:
+            existing = {}
+            for query, executions, total_ms in self._logged_queries(db_file):
+                try:
+                    candidates = self._candidates(conn, query)
+                except sqlite3.Error:
+                    # 語句已不適用於目前的 schema（例如重新上傳後）
+                    continue
+
+                # 自我連接會讓同一張表掃描兩次，每個建議只計入一次這個查詢
+                counted = set()
+                for table, key, reads in candidates:
+                    if table not in existing:
+                        existing[table] = self._existing_index_keys(conn, table)
+                    if any(index[: len(key)] == key for index in existing[table]):
+                        continue
+
+                    covering = key + [c for c in reads if c not in key]
+                    columns = covering if len(covering) <= MAX_INDEX_COLUMNS else key
+                    digest = hashlib.sha1(
+                        "\x1f".join([table] + columns).encode("utf-8")
+                    ).hexdigest()[:12]
+                    if digest in counted:
+                        continue
+                    counted.add(digest)
+                    rec = recommendations.setdefault(
+                        digest,
+                        {
+                            "name": f"{INDEX_PREFIX}{digest}",
+                            "table": table,
+                            "columns": columns,
+                            "key_columns": key,
+                            "executions": 0,
+                            "total_ms": 0.0,
+                            "queries": [],
+                        },
+                    )
+                    rec["executions"] += executions
+                    rec["total_ms"] = round(rec["total_ms"] + total_ms, 2)
+                    if len(rec["queries"]) < 3:
+                        rec["queries"].append(query)
+
+        return sorted(
+            (
+                rec
+                for rec in recommendations.values()
+                if rec["executions"] >= self.min_executions
+            ),
+            key=lambda rec: rec["total_ms"],
+            reverse=True,
+        )
+
+    @staticmethod
+    def _time_queries(db_file, queries):
+        """
+        Times queries on pooled read-only connections, each run within a budget.
+
+        Returns:
+            dict: Best-of-three milliseconds per query; queries that exceed
+            TIMING_TIMEOUT_MS or fail are left out.
+        """
+        timings = {}
+        for query in queries:
+            best = None
+            try:
+                for _ in range(3):
+                    budget = QueryBudget(timeout_ms=TIMING_TIMEOUT_MS)
+                    with read_pool.connection(db_file) as conn, budget.attach(conn):
+                        start = time.perf_counter()
+                        cursor = conn.execute(query)
+                        try:
+                            fetched = 0
+                            while fetched < TIMING_MAX_ROWS:
+                                rows = cursor.fetchmany(1000)
+                                if not rows:
+                                    break
+                                fetched += len(rows)
+                        finally:
+                            cursor.close()
+                        elapsed = (time.perf_counter() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+            except sqlite3.Error as e:
+                logger.info(
+                    "IndexAdvisor: skipped timing (%s): %s", budget.reason or e, query
+                )
+                continue
+            timings[query] = round(best, 2)
+        return timings
+
+    def indexes(self, db_file):
+        """Returns the advisor indexes that still exist in the database"""
+        if not os.path.exists(query_log_path(db_file)):
+            return []
+        with closing(
+            sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+        ) as conn:
+            present = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' "
+                    "AND name LIKE ?",
+                    (f"{INDEX_PREFIX}%",),
+                )
+            }
+        with closing(self._connect_log(db_file)) as conn:
+            rows = conn.execute(
+                "SELECT name, table_name, columns, size_bytes, before_ms, after_ms, "
+                "created_at FROM advisor_indexes ORDER BY created_at"
+            ).fetchall()
+        keys = ["name", "table", "columns", "size_bytes", "before_ms", "after_ms"]
+        indexes = []
+        for row in rows:
+            if row[0] in present:
+                index = dict(zip(keys + ["created_at"], row))
+                index["columns"] = index["columns"].split("\x1f")
+                indexes.append(index)
+        return indexes
+
+    def apply(self, db_file, names=None):
+        """
+        Creates recommended indexes within the count and disk size budget.
+
+        Args:
+            db_file (str): Filesystem path of the SQLite database.
+            names (list): Only create these recommendations; all when None.
+
+        Returns:
+            list: One dict per recommendation with "name", "table", "columns",
+            "status" ("created" or "skipped"), and "size_bytes", "before_ms",
+            "after_ms" for created indexes or "reason" for skipped ones.
+
+        An index that does not make its queries faster, for example because it
+        displaces a better automatic index, is dropped again and remembered, so
+        later runs without explicit names do not retry it.
+        """
+        recommendations = self.advise(db_file)
+        if names is not None:
+            recommendations = [rec for rec in recommendations if rec["name"] in names]
+
+        existing = self.indexes(db_file)
+        rejected = self._rejected(db_file) if names is None else set()
+        count = len(existing)
+        used_bytes = sum(index["size_bytes"] or 0 for index in existing)
+
+        results = []
+        with closing(sqlite3.connect(db_file, timeout=30)) as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            for rec in recommendations:
+                result = {
+                    "name": rec["name"],
+                    "table": rec["table"],
+                    "columns": rec["columns"],
+                }
+                results.append(result)
+                if rec["name"] in rejected:
+                    result.update(status="skipped", reason="先前建立後查詢未變快")
+                    continue
+                if count >= self.max_indexes:
+                    result.update(status="skipped", reason="已達索引數量上限")
+                    continue
+
+                before = self._time_queries(db_file, rec["queries"])
+                if not before:
+                    result.update(
+                        status="skipped", reason="查詢超過執行時間上限，無法量測"
+                    )
+                    continue
+
+                pages = conn.execute("PRAGMA page_count").fetchone()[0]
+                column_list = ", ".join(f'"{c}"' for c in rec["columns"])
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{rec["name"]}" '
+                    f'ON "{rec["table"]}" ({column_list})'
+                )
+                conn.commit()
+                size_bytes = (
+                    conn.execute("PRAGMA page_count").fetchone()[0] - pages
+                ) * page_size
+
+                if used_bytes + size_bytes > self.max_bytes:
+                    conn.execute(f'DROP INDEX "{rec["name"]}"')
+                    conn.commit()
+                    result.update(status="skipped", reason="已達索引磁碟空間上限")
+                    continue
+
+                after = self._time_queries(db_file, list(before))
+                timed = [query for query in before if query in after]
+                before_ms = round(sum(before[query] for query in timed), 2)
+                after_ms = round(sum(after[query] for query in timed), 2)
+                if after_ms >= before_ms:
+                    # 新索引可能取代了更好的自動索引，查詢反而變慢時撤回
+                    conn.execute(f'DROP INDEX "{rec["name"]}"')
+                    conn.commit()
+                    with closing(self._connect_log(db_file)) as log, log:
+                        log.execute(
+                            "INSERT OR REPLACE INTO rejected_indexes "
+                            "VALUES (?, ?, ?, ?)",
+                            (rec["name"], before_ms, after_ms, time.time()),
+                        )
+                    result.update(
+                        status="skipped",
+                        reason=f"建立後查詢未變快（{before_ms:.2f}ms → "
+                        f"{after_ms:.2f}ms），已移除索引",
+                    )
+                    logger.info(
+                        "IndexAdvisor: dropped %s, %.2fms -> %.2fms",
+                        rec["name"],
+                        before_ms,
+                        after_ms,
+                    )
+                    continue
+                count += 1
+                used_bytes += size_bytes
+                result.update(
+                    status="created",
+                    size_bytes=size_bytes,
+                    before_ms=before_ms,
+                    after_ms=after_ms,
+                )
+                with closing(self._connect_log(db_file)) as log, log:
+                    log.execute(
+                        "INSERT OR REPLACE INTO advisor_indexes "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            rec["name"],
+                            rec["table"],
+                            "\x1f".join(rec["columns"]),
+                            size_bytes,
+                            before_ms,
+                            after_ms,
+                            time.time(),
+                        ),
+                    )
+                logger.info(
+                    "IndexAdvisor: created %s on %s(%s), %d bytes, %.2fms -> %.2fms",
+                    rec["name"],
+                    rec["table"],
+                    ", ".join(rec["columns"]),
+                    size_bytes,
+                    before_ms,
+                    after_ms,
+                )
+        return results
+
+
+index_advisor = IndexAdvisor(
+    mode=os.environ.get("INDEX_ADVISOR_MODE", "suggest"),
+    max_indexes=int(os.environ.get("INDEX_ADVISOR_MAX_INDEXES", "8")),
+    max_bytes=int(os.environ.get("INDEX_ADVISOR_MAX_BYTES", str(256 * 1024 * 1024))),
+    min_executions=int(os.environ.get("INDEX_ADVISOR_MIN_EXECUTIONS", "3")),
+)
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobProgress:
+    """
+    Progress handle passed to an ingestion function.
+
+    The function calls update() as it goes; state is flushed to the job file at
+    most every flush_interval seconds so progress reporting stays cheap.
+    """
+
+    flush_interval = 0.5
+
+    def __init__(self, manager, job_id):
+        self._manager = manager
+        self._job_id = job_id
+        self._last_flush = 0.0
+
+    def update(self, **fields):
+        """Records progress fields such as rows, bytes_read, shard and phase"""
+        force = "phase" in fields or "total_shards" in fields
+        self._manager._update(self._job_id, fields)
+        now = time.monotonic()
+        if force or now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            self._manager._flush(self._job_id)
+
+
+class IngestJobManager:
+    """
+    Runs CSV ingestion jobs on a background thread pool.
+
+    Uploads return a job id immediately instead of converting inside the request
+    thread. Job state is mirrored to small JSON files so a status request served
+    by any gunicorn worker can report rows ingested, bytes read, the current
+    shard and an ETA.
+
+    Attributes:
+        jobs_dir (str): Directory holding one JSON state file per job.
+        retention (int): Seconds a finished job's state file is kept.
+    """
+
+    def __init__(self, jobs_dir, max_workers=2, retention=24 * 3600):
+        self.jobs_dir = jobs_dir
+        self.retention = retention
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest"
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def submit(self, func, *args, total_bytes=0, **job_fields):
+        """
+        Queues func(*args, progress=JobProgress) and returns the job id.
+
+        func should return a dict of result fields, or raise to fail the job.
+        """
+        self._cleanup()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "phase": "queued",
+                "rows": 0,
+                "bytes_read": 0,
+                "total_bytes": total_bytes,
+                "shard": 1,
+                "total_shards": 1,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "error": None,
+                **job_fields,
+            }
+        self._flush(job_id)
+        self._executor.submit(self._run, job_id, func, args)
+        return job_id
+
+    def _run(self, job_id, func, args):
+        self._update(job_id, {"status": "running", "started_at": time.time()})
+        self._flush(job_id)
+        try:
+            result = func(*args, progress=JobProgress(self, job_id)) or {}
+            self._update(job_id, {**result, "status": "succeeded", "phase": "done"})
+        except Exception as e:
+            logger.error("Ingestion job %s failed: %s", job_id, e)
+            self._update(job_id, {"status": "failed", "error": str(e)})
+        finally:
+            self._update(job_id, {"finished_at": time.time()})
+            self._flush(job_id)
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+    def _update(self, job_id, fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _flush(self, job_id):
+        with self._lock:
+            state = dict(self._jobs.get(job_id) or {})
+        if not state:
+            return
+        tmp_path = self._path(job_id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(job_id))
+
+    def status(self, job_id):
+        """
+        Returns the job state with a computed fraction and ETA, or None if unknown.
+        """
+        if not job_id or not job_id.isalnum():
+            return None
+        with self._lock:
+            state = dict(self._jobs[job_id]) if job_id in self._jobs else None
+        if state is None:
+            try:
+                with open(self._path(job_id), "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                return None
+
+        total_bytes = state.get("total_bytes") or 0
+        total_shards = max(state.get("total_shards") or 1, 1)
+        fraction = 0.0
+        if state["status"] == "succeeded":
+            fraction = 1.0
+        elif total_bytes:
+            done = (state.get("shard", 1) - 1) * total_bytes + state["bytes_read"]
+            fraction = min(done / (total_bytes * total_shards), 1.0)
+        state["fraction"] = round(fraction, 4)
+
+        state["eta_seconds"] = None
+        if state["status"] == "running" and state.get("started_at") and fraction > 0:
+            elapsed = time.time() - state["started_at"]
+            state["eta_seconds"] = round(elapsed * (1 - fraction) / fraction, 1)
+        return state
+
+    def _cleanup(self):
+        cutoff = time.time() - self.retention
+        try:
+            for name in os.listdir(self.jobs_dir):
+                path = os.path.join(self.jobs_dir, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError as e:
+            logger.warning("Failed to clean up ingestion jobs: %s", e)
+
+
+ingest_jobs = IngestJobManager(
+    os.environ.get("INGEST_JOBS_DIR", os.path.join(".cache", "jobs")),
+    max_workers=int(os.environ.get("INGEST_WORKERS", "2")),
+)
@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import openai
+from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
+
+from services.llm_factory import MODEL_NAMES
+
+logger = logging.getLogger(__name__)
+
+# 驗證請求的逾時秒數
+CHECK_TIMEOUT = 10
+
+_PROVIDER_NAMES = {"openai": "OpenAI", "gemini": "Google"}
+
+
+class KeyCheckFailed(Exception):
+    """
+    A provider rejected a key.
+
+    Attributes:
+        definitive (bool): True only for authentication failures (the key is
+            invalid or not allowed to use the model), so the result may be
+            cached; False for rate limits, missing models, network errors and
+            provider outages, which may succeed on retry.
+    """
+
+    def __init__(self, message, definitive):
+        super().__init__(message)
+        self.definitive = definitive
+
+
+def _check_openai(api_key):
+    """Retrieves the agent's model, which needs a valid key but no tokens"""
+    client = openai.OpenAI(api_key=api_key, timeout=CHECK_TIMEOUT, max_retries=0)
+    try:
+        client.models.retrieve(MODEL_NAMES["openai"])
+    except openai.AuthenticationError:
+        raise KeyCheckFailed("OpenAI API Key 無效", True)
+    except openai.PermissionDeniedError:
+        raise KeyCheckFailed(
+            f"OpenAI API Key 無法使用模型 {MODEL_NAMES['openai']}", True
+        )
+    except openai.NotFoundError:
+        raise KeyCheckFailed(f"OpenAI 找不到模型 {MODEL_NAMES['openai']}", False)
+    except openai.RateLimitError as e:
+        if "quota" in str(e).lower():
+            raise KeyCheckFailed("OpenAI API 配額已用盡", False)
+        raise KeyCheckFailed(f"OpenAI API 請求過於頻繁，請稍後再試: {e}", False)
+    except openai.OpenAIError as e:
+        raise KeyCheckFailed(f"OpenAI API Key 驗證失敗: {e}", False)
+    finally:
+        client.close()
+
+
+def _check_gemini(api_key):
+    """Fetches the agent's model metadata, which needs a valid key but no tokens"""
+    client = genai.Client(
+        api_key=api_key,
+        http_options=genai_types.HttpOptions(timeout=CHECK_TIMEOUT * 1000),
+    )
+    try:
+        client.models.get(model=MODEL_NAMES["gemini"])
+    except genai_errors.ClientError as e:
+        # 無效的 Key 會回傳 400 API_KEY_INVALID，其他 400 錯誤不代表 Key 無效
+        if e.code in (401, 403) or (e.code == 400 and "API_KEY_INVALID" in str(e)):
+            raise KeyCheckFailed("Google API Key 無效", True)
+        if e.code == 404:
+            raise KeyCheckFailed(f"Google 找不到模型 {MODEL_NAMES['gemini']}", False)
+        if e.code == 429:
+            # 配額或頻率限制都可能隨時間恢復，不快取結果
+            raise KeyCheckFailed(
+                "Google API 配額已用盡或請求過於頻繁，請稍後再試", False
+            )
+        raise KeyCheckFailed(f"Google API Key 驗證失敗: {e}", False)
+    except Exception as e:
+        raise KeyCheckFailed(f"Google API Key 驗證失敗: {e}", False)
+
+
+_CHECKS = {"openai": _check_openai, "gemini": _check_gemini}
+
+
+class APIKeyValidator:
+    """
+    Validates provider API keys with a metadata call and caches the verdict.
+
+    Each check fetches the agent's model from the provider's model endpoint
+    instead of running a completion, so it costs no tokens and answers in a
+    single round trip. Verdicts are cached in memory under a SHA-256 of the key
+    with a per-process random salt, so the cache never holds the key itself and
+    its entries are useless outside this process. Valid keys are cached for ttl
+    seconds and authentication failures for negative_ttl seconds, letting a
+    user who fixes their key retry soon; rate limits, quota errors and network
+    errors are never cached.
+
+    A metadata call does not consume quota, so a key whose quota is exhausted
+    may still validate; the first agent query then reports the quota error.
+
+    Attributes:
+        ttl (int): Seconds a valid key stays cached.
+        negative_ttl (int): Seconds a rejected key stays cached.
+        max_entries (int): Maximum number of cached verdicts.
+        hits (int): Validations answered from the cache.
+        misses (int): Validations that called the provider.
+    """
+
+    def __init__(self, ttl=3600, negative_ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._salt = os.urandom(16)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_key(self, model_type, api_key):
+        digest = hashlib.sha256(self._salt)
+        digest.update(f"{model_type}\0{api_key}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def validate(self, model_type, api_key):
+        """
+        Checks an API key, answering from the cache when possible.
+
+        Args:
+            model_type (str): "openai" or "gemini".
+            api_key (str): The key to check.
+
+        Returns:
+            dict: {"success": True, "message"} or {"success": False, "error"},
+            plus "cached" telling whether the provider was skipped.
+
+        Raises:
+            ValueError: If model_type is not supported.
+        """
+        check = _CHECKS.get(model_type)
+        if check is None:
+            raise ValueError("不支持的模型類型")
+
+        key = self._make_key(model_type, api_key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1], cached=True)
+            self.misses += 1
+
+        try:
+            check(api_key)
+            result = {
+                "success": True,
+                "message": f"{_PROVIDER_NAMES[model_type]} API Key 驗證成功",
+            }
+            expires_at = now + self.ttl
+        except KeyCheckFailed as e:
+            result = {"success": False, "error": str(e)}
+            if not e.definitive:
+                logger.warning("API key check for %s failed: %s", model_type, e)
+                return dict(result, cached=False)
+            expires_at = now + self.negative_ttl
+
+        with self._lock:
+            self._entries[key] = (expires_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(result, cached=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+key_validator = APIKeyValidator(
+    ttl=int(os.environ.get("API_KEY_VALIDATION_TTL", "3600")),
+    negative_ttl=int(os.environ.get("API_KEY_VALIDATION_NEGATIVE_TTL", "60")),
+)
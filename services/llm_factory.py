@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+# 各模型類型使用的模型名稱
+MODEL_NAMES = {
+    "openai": "gpt-4.1-nano",
+    "gemini": "gemini-2.5-flash",
+}
+
+# 每個 API Key 每分鐘的 LLM 請求上限，各 worker 分別計算（0 代表不限制）
+REQUESTS_PER_MINUTE = {
+    "openai": int(os.environ.get("LLM_RPM_OPENAI", "500")),
+    "gemini": int(os.environ.get("LLM_RPM_GEMINI", "1000")),
+}
+
+
+def credential_fingerprint(api_key):
+    """Return a short, non-reversible fingerprint of an API key"""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMClientCache:
+    """
+    An LRU cache of LLM clients keyed by model and hashed credential.
+
+    Callers' API keys are passed explicitly to each client instead of through
+    OPENAI_API_KEY / GOOGLE_API_KEY, which are process-global and would leak
+    one request's key into another under threaded or async workers. Clients are
+    keyed by the SHA-256 of the key, so concurrent requests with different keys
+    get separate clients while requests with the same key share one client and
+    its keep-alive connections. The key itself is never stored in the cache key.
+
+    Each client carries its own rate limiter sized from REQUESTS_PER_MINUTE,
+    matching providers that enforce request limits per key, so a batch fanning
+    out many questions waits for tokens instead of collecting 429 responses.
+
+    Without an api_key the client falls back to the server's own environment
+    configuration.
+
+    Attributes:
+        max_size (int): Maximum number of clients kept alive at once.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rate_limiter(model_type):
+        rpm = REQUESTS_PER_MINUTE.get(model_type, REQUESTS_PER_MINUTE["openai"])
+        if rpm <= 0:
+            return None
+        requests_per_second = rpm / 60
+        # 允許約一秒的突發量，批次開頭的並行請求不必逐一排隊
+        return InMemoryRateLimiter(
+            requests_per_second=requests_per_second,
+            check_every_n_seconds=0.05,
+            max_bucket_size=max(1.0, requests_per_second),
+        )
+
+    def _build(self, model_type, api_key, temperature):
+        rate_limiter = self._rate_limiter(model_type)
+        if model_type == "gemini":
+            kwargs = {"google_api_key": api_key} if api_key else {}
+            return ChatGoogleGenerativeAI(
+                model=MODEL_NAMES["gemini"],
+                temperature=temperature,
+                rate_limiter=rate_limiter,
+                **kwargs,
+            )
+        # default to openai
+        kwargs = {"api_key": api_key} if api_key else {}
+        return ChatOpenAI(
+            model=MODEL_NAMES["openai"],
+            temperature=temperature,
+            rate_limiter=rate_limiter,
+            **kwargs,
+        )
+
+    def get(self, model_type="openai", api_key=None, temperature=0.2):
+        """
+        Return the shared client for a model type and credential.
+
+        Args:
+            model_type (str): "openai" or "gemini".
+            api_key (str): The caller's API key, or None for the server default.
+            temperature (float): Sampling temperature of the client.
+
+        Returns:
+            BaseChatModel: A chat model bound to the given credential.
+        """
+        key_hash = (
+            hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else ""
+        )
+        key = (model_type, temperature, key_hash)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+        client = self._build(model_type, api_key, temperature)
+
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                self._clients.move_to_end(key)
+                return existing
+            self._clients[key] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+
+        logger.info(
+            "LLMClientCache: created %s client (%s)",
+            model_type,
+            credential_fingerprint(api_key) or "default credentials",
+        )
+        return client
+
+    def __len__(self):
+        return len(self._clients)
+
+
+llm_clients = LLMClientCache(
+    max_size=int(os.environ.get("LLM_CLIENT_CACHE_SIZE", "32"))
+)
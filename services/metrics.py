@@ -0,0 +1,279 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 各 worker 定期把累計值寫入此目錄，/metrics 讀取所有檔案後加總
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(".cache", "metrics"))
+FLUSH_INTERVAL = 2.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+THROUGHPUT_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Prometheus counters and histograms aggregated across gunicorn workers.
+
+    Each worker accumulates values in memory and writes a cumulative snapshot
+    to METRICS_DIR/<pid>-<token>.json every FLUSH_INTERVAL seconds from a
+    daemon thread, so recording never waits on I/O. render() sums the
+    snapshots of every worker and returns the Prometheus text exposition
+    format, whichever worker serves the scrape. Snapshots of exited workers
+    are kept, so counters do not drop when a worker is recycled; the random
+    token keeps a new worker that reuses a pid from overwriting them. clear()
+    removes every snapshot and is called by gunicorn.conf.py when the master
+    starts, so counters restart with the server.
+
+    Metric families are declared up front with counter() and histogram(); the
+    declarations are module-level, so every worker agrees on them.
+
+    Attributes:
+        directory (str): Directory holding one snapshot file per worker.
+        flush_interval (float): Seconds between snapshot writes.
+    """
+
+    def __init__(self, directory, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._families = {}
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+        self._snapshot_name = None
+
+    def counter(self, name, documentation):
+        """Declares a counter family"""
+        self._families[name] = ("counter", documentation, None)
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        """Declares a histogram family with the given upper bounds"""
+        self._families[name] = ("histogram", documentation, tuple(buckets))
+
+    @staticmethod
+    def _label_key(labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Adds value to a counter"""
+        key = (name, self._label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name, value, **labels):
+        """Records one observation in a histogram"""
+        buckets = self._families[name][2]
+        key = (name, self._label_key(labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = {
+                    "buckets": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the wall-clock seconds spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _ensure_flusher(self):
+        # gunicorn 會 fork worker，因此在每個程序第一次記錄時才啟動寫入執行緒
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+            self._snapshot_name = f"{pid}-{os.urandom(4).hex()}.json"
+        flusher = threading.Thread(target=self._flush_loop, name="metrics", daemon=True)
+        flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Writes this worker's cumulative values to its snapshot file"""
+        with self._lock:
+            if not self._dirty or self._snapshot_name is None:
+                return
+            snapshot = {
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                "histograms": [
+                    [name, labels, dict(entry, buckets=list(entry["buckets"]))]
+                    for (name, labels), entry in self._histograms.items()
+                ],
+            }
+            self._dirty = False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, self._snapshot_name)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to write metrics snapshot: %s", e)
+
+    def clear(self):
+        """Removes every worker's snapshot file"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for file_name in names:
+            if file_name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                except OSError as e:
+                    logger.warning("Failed to remove metrics snapshot: %s", e)
+
+    def _collect(self):
+        counters = {}
+        histograms = {}
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".json")]
+        except OSError:
+            names = []
+        for file_name in names:
+            try:
+                with open(
+                    os.path.join(self.directory, file_name), "r", encoding="utf-8"
+                ) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in snapshot.get("counters", []):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, entry in snapshot.get("histograms", []):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.setdefault(
+                    key,
+                    {"buckets": [0] * len(entry["buckets"]), "sum": 0.0, "count": 0},
+                )
+                if len(total["buckets"]) != len(entry["buckets"]):
+                    # 桶界線變更前留下的舊快照，無法合併
+                    continue
+                total["buckets"] = [
+                    a + b for a, b in zip(total["buckets"], entry["buckets"])
+                ]
+                total["sum"] += entry["sum"]
+                total["count"] += entry["count"]
+        return counters, histograms
+
+    def render(self):
+        """Returns every worker's metrics summed, in Prometheus text format"""
+        self.flush()
+        counters, histograms = self._collect()
+        lines = []
+        for name, (kind, documentation, buckets) in self._families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (series, labels), value in sorted(counters.items()):
+                    if series == name:
+                        lines.append(
+                            f"{name}{_format_labels(labels)} {_format_number(value)}"
+                        )
+                continue
+            for (series, labels), entry in sorted(histograms.items()):
+                if series != name:
+                    continue
+                for bound, count in zip(buckets, entry["buckets"]):
+                    le = ("le", _format_number(bound))
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {count}")
+                inf_labels = _format_labels(labels, ("le", "+Inf"))
+                lines.append(f"{name}_bucket{inf_labels} {entry['count']}")
+                lines.append(
+                    f"{name}_sum{_format_labels(labels)} {_format_number(entry['sum'])}"
+                )
+                lines.append(f"{name}_count{_format_labels(labels)} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(METRICS_DIR)
+
+metrics.histogram(
+    "sql_agent_node_seconds", "Time spent in each SQLAgent graph node", LATENCY_BUCKETS
+)
+metrics.histogram(
+    "sql_agent_schema_render_seconds",
+    "Time spent rendering the schema for the SQL prompt",
+    LATENCY_BUCKETS,
+)
+metrics.histogram(
+    "sql_agent_llm_seconds", "Latency of LLM calls by call site", LATENCY_BUCKETS
+)
+metrics.counter("sql_agent_llm_tokens_total", "LLM tokens by call site and kind")
+metrics.histogram(
+    "sql_agent_result_rows", "Rows returned by executed agent queries", ROW_BUCKETS
+)
+metrics.counter("sql_agent_answers_total", "Answers by source")
+metrics.counter(
+    "sql_agent_validation_failures_total", "Generated SQL rejected by validation"
+)
+metrics.counter("sql_cache_requests_total", "Cache lookups by cache and outcome")
+metrics.counter("sql_aborted_total", "Queries stopped by their budget or cancelled")
+metrics.histogram(
+    "sql_execute_seconds", "SQLite execution time of executed queries", LATENCY_BUCKETS
+)
+metrics.counter("csv_ingest_jobs_total", "CSV conversions by outcome")
+metrics.counter("csv_ingest_rows_total", "Rows written by CSV conversions")
+metrics.counter("csv_ingest_bytes_total", "CSV bytes converted")
+metrics.histogram(
+    "csv_ingest_seconds",
+    "Duration of CSV conversions",
+    (1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+metrics.histogram(
+    "csv_ingest_rows_per_second",
+    "Rows per second written by CSV conversions",
+    THROUGHPUT_BUCKETS,
+)
@@ -12,7 +12,7 @@ SQLTEMPLATE = """
 - 請優先先確認欄位說明文件以及使用者的問題去評估是否要使用多張table進行JOIN，並且要確實使用JOIN的方式去做連接。
 - 若需要跨表格查詢，必須嚴格按照提供的 Foreign Key 關係進行 JOIN。
 - 嚴格禁止使用 SELECT *，僅挑選與問題最相關且必要的欄位。
-- 有日期資訊的欄位，不管使用者的問題是只問年還是月，請完全按照範例格式的日期下去做填寫，請勿用任何省略的方式去做。如：使用者問，我要2022年，請參照欄位說明文件，假設欄位說明文件中的時間格式為2020/12/31 00:00:00的話，那就請以2020/12/31 00:00:00的格式去做填寫。（請參照欄位說明文件裡面的時間範例格式）
+- 有日期資訊的欄位，不管使用者的問題是只問年還是月，請完全按照範例格式的日期下去做填寫，請勿用任何省略的方式去做。如：使用者問，我要2022年，請參照欄位說明文件，假設欄位說明文件中的時間格式為2020/12/31 00:00:00的話，那就請以2020/12/31 00:00:00的格式去做填寫。（請參照欄位說明文件裡面的時間範例格式）若範例為 2020-12-31 00:00:00 這類 ISO 格式，可直接使用 BETWEEN、>=、< 或 strftime 進行日期範圍篩選。
 - 涉及數量、排名或排序相關問題，必須明確使用聚合函數 (COUNT, SUM, AVG) 以及 GROUP BY 或 ORDER BY。
 - 若用戶未特別指定查詢數量，請將結果嚴格限制最多 {top_k} 筆。
 - 不得推測任何 Schema 未定義之內容，也不可引用不存在的欄位或表格。
@@ -22,4 +22,13 @@ SQLTEMPLATE = """
 *你只能輸出sql query, 其他以外的文字完全都不行，如果用戶問題查不到的話，請直接輸出查無結果*
 
 用戶問題：{input}
-"""
\ No newline at end of file
+"""
+
+SQLREPAIRTEMPLATE = """
+
+上一次產生的 SQL 查詢在執行前的驗證失敗，請修正後重新產生：
+SQL 查詢語法：{query}
+錯誤訊息：{error}
+
+請只使用上述 Schema 中存在的 table 與 column，並只產生單一的 SELECT 查詢。
+"""
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 單一查詢的執行預算；VM 步數為 0 表示不限制
+DEFAULT_TIMEOUT_MS = int(os.environ.get("SQL_TIMEOUT_MS", "15000"))
+DEFAULT_MAX_VM_STEPS = int(os.environ.get("SQL_MAX_VM_STEPS", "0"))
+DEFAULT_MAX_ROWS = int(os.environ.get("SQL_MAX_ROWS", "100000"))
+
+# 每執行多少個 VM 指令呼叫一次 progress handler
+PROGRESS_INTERVAL = 10000
+
+# 取消標記檔的檢查間隔（秒），讓其他 gunicorn worker 收到的取消請求也能生效
+CANCEL_CHECK_INTERVAL = 0.2
+CANCEL_MARKER_TTL = 600
+CANCEL_DIR = os.environ.get("SQL_CANCEL_DIR", os.path.join(".cache", "cancel"))
+
+_ERROR_MESSAGES = {
+    "timeout": "查詢超過執行時間上限 {timeout_ms} 毫秒，已中止",
+    "step_limit": "查詢超過 {max_vm_steps} 個 VM 執行步數上限，已中止",
+    "cancelled": "查詢已被取消",
+}
+
+_active = {}
+_active_lock = threading.Lock()
+
+
+def _marker_path(query_id):
+    return os.path.join(CANCEL_DIR, query_id)
+
+
+def is_valid_query_id(query_id):
+    """Query ids are client-chosen, so only short alphanumeric ids are accepted"""
+    return (
+        bool(query_id) and len(query_id) <= 64 and query_id.replace("-", "").isalnum()
+    )
+
+
+class QueryBudget:
+    """
+    Time and VM-step limits for one SQL statement, plus cancellation.
+
+    attach() installs the budget as the connection's SQLite progress handler,
+    which runs every PROGRESS_INTERVAL virtual machine instructions and aborts
+    the statement once the deadline or step budget is exceeded. cancel()
+    interrupts the running statement immediately through
+    connection.interrupt(); a cancel received by another worker is picked up
+    through a marker file named after the query id.
+
+    Attributes:
+        query_id (str): Client-chosen id used to cancel the query, or None.
+        timeout_ms (int): Wall-clock budget in milliseconds, 0 for no limit.
+        max_vm_steps (int): VM instruction budget, 0 for no limit.
+        reason (str): "timeout", "step_limit" or "cancelled" once aborted.
+    """
+
+    def __init__(self, query_id=None, timeout_ms=None, max_vm_steps=None):
+        self.query_id = query_id if is_valid_query_id(query_id) else None
+        self.timeout_ms = DEFAULT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+        self.max_vm_steps = (
+            DEFAULT_MAX_VM_STEPS if max_vm_steps is None else max_vm_steps
+        )
+        self.reason = None
+        self.steps = 0
+        self._start = time.monotonic()
+        self._next_cancel_check = 0.0
+        self._cancelled = threading.Event()
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def __call__(self):
+        self.steps += PROGRESS_INTERVAL
+        now = time.monotonic()
+        if self._cancelled.is_set():
+            self.reason = "cancelled"
+        elif self.query_id and now >= self._next_cancel_check:
+            self._next_cancel_check = now + CANCEL_CHECK_INTERVAL
+            if os.path.exists(_marker_path(self.query_id)):
+                self.reason = "cancelled"
+        if self.reason is None:
+            if self.timeout_ms and (now - self._start) * 1000 > self.timeout_ms:
+                self.reason = "timeout"
+            elif self.max_vm_steps and self.steps > self.max_vm_steps:
+                self.reason = "step_limit"
+        # 回傳非零值會讓 SQLite 以 interrupted 錯誤中止語句
+        return 1 if self.reason else 0
+
+    def cancel(self):
+        """Flags the query as cancelled and interrupts it if it is running"""
+        self._cancelled.set()
+        self.reason = self.reason or "cancelled"
+        # 持有鎖避免中斷到已歸還連線池、正在執行其他查詢的連線
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    @contextmanager
+    def attach(self, conn):
+        """Enforces the budget on every statement run on conn inside the block"""
+        self._conn = conn
+        if self.query_id:
+            with _active_lock:
+                _active[self.query_id] = self
+        conn.set_progress_handler(self, PROGRESS_INTERVAL)
+        try:
+            yield self
+        finally:
+            with self._conn_lock:
+                self._conn = None
+            conn.set_progress_handler(None, 0)
+            if self.query_id:
+                with _active_lock:
+                    _active.pop(self.query_id, None)
+                try:
+                    os.remove(_marker_path(self.query_id))
+                except OSError:
+                    pass
+
+    def error(self):
+        """Returns the structured error reported when the budget was exceeded"""
+        return {
+            "success": False,
+            "error": _ERROR_MESSAGES[self.reason].format(
+                timeout_ms=self.timeout_ms, max_vm_steps=self.max_vm_steps
+            ),
+            "error_type": self.reason,
+            "query_id": self.query_id,
+            "elapsed_ms": round((time.monotonic() - self._start) * 1000, 2),
+            "vm_steps": self.steps,
+            "limits": {
+                "timeout_ms": self.timeout_ms,
+                "max_vm_steps": self.max_vm_steps,
+            },
+        }
+
+
+def cancel_query(query_id):
+    """
+    Cancels an in-flight query by id in this worker or, via a marker file, in
+    whichever worker is running it.
+
+    Returns:
+        bool: True if the query was running in this worker.
+    """
+    if not is_valid_query_id(query_id):
+        raise ValueError("無效的查詢 ID")
+    with _active_lock:
+        budget = _active.get(query_id)
+    if budget is not None:
+        budget.cancel()
+        return True
+
+    os.makedirs(CANCEL_DIR, exist_ok=True)
+    _cleanup_markers()
+    with open(_marker_path(query_id), "w"):
+        pass
+    return False
+
+
+def _cleanup_markers():
+    cutoff = time.time() - CANCEL_MARKER_TTL
+    try:
+        for name in os.listdir(CANCEL_DIR):
+            path = os.path.join(CANCEL_DIR, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    except OSError as e:
+        logger.warning("Failed to clean up cancel markers: %s", e)
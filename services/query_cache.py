@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_PUNCTUATION = "?？。.!！;；"
+
+
+def normalize_question(question):
+    """Normalizes width, case, whitespace and trailing punctuation of a question"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+class NL2SQLCache:
+    """
+    A durable cache from natural-language questions to generated SQL.
+
+    Entries live in a SQLite side file so every gunicorn worker shares them.
+    They are keyed by (normalized question, schema hash, model_type), expire
+    after a TTL and are evicted least-recently-used beyond max_entries. Hit and
+    miss counters are stored in the same file so they aggregate across workers.
+
+    Attributes:
+        path (str): Location of the SQLite cache file.
+        ttl (int): Entry lifetime in seconds.
+        max_entries (int): Maximum number of cached questions.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS nl2sql ("
+                "key TEXT PRIMARY KEY, question TEXT, schema_hash TEXT, "
+                "model_type TEXT, query TEXT, created_at REAL, last_used REAL, "
+                "hits INTEGER DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS nl2sql_last_used ON nl2sql (last_used)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats "
+                "(name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    @staticmethod
+    def make_key(question, schema_hash, model_type):
+        raw = "\x1f".join([normalize_question(question), schema_hash, model_type])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached SQL for a key, or None on a miss or expired entry.
+        """
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    "SELECT query, created_at FROM nl2sql WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM nl2sql WHERE key = ?", (key,))
+                    row = None
+
+                if row is None:
+                    conn.execute(
+                        "UPDATE stats SET value = value + 1 WHERE name = 'misses'"
+                    )
+                    return None
+
+                conn.execute(
+                    "UPDATE nl2sql SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                    (now, key),
+                )
+                conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning("NL2SQLCache: lookup failed: %s", e)
+            return None
+
+    def put(self, key, question, schema_hash, model_type, query):
+        """Stores generated SQL and evicts the least recently used entries"""
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO nl2sql "
+                    "(key, question, schema_hash, model_type, query, created_at, "
+                    "last_used, hits) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                    (key, question, schema_hash, model_type, query, now, now),
+                )
+                conn.execute(
+                    "DELETE FROM nl2sql WHERE created_at < ?", (now - self.ttl,)
+                )
+                conn.execute(
+                    "DELETE FROM nl2sql WHERE key IN (SELECT key FROM nl2sql "
+                    "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            logger.warning("NL2SQLCache: store failed: %s", e)
+
+    def stats(self):
+        """Returns the hit/miss counters and entry count shared by all workers"""
+        with closing(self._connect()) as conn:
+            counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM nl2sql").fetchone()[0]
+        counters["entries"] = entries
+        return counters
+
+
+nl2sql_cache = NL2SQLCache(
+    os.environ.get("NL2SQL_CACHE_PATH", os.path.join(".cache", "nl2sql.sqlite3")),
+    ttl=int(os.environ.get("NL2SQL_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.environ.get("NL2SQL_CACHE_MAX_ENTRIES", "10000")),
+)
@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 只讀查詢允許出現的授權動作
+READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+
+# 結果會隨時間或連線狀態改變的函數，不可快取
+_VOLATILE_FUNCTIONS = {
+    "random",
+    "randomblob",
+    "changes",
+    "total_changes",
+    "last_insert_rowid",
+}
+_TIME_FUNCTIONS = {"date", "time", "datetime", "julianday", "strftime", "unixepoch"}
+
+# 取得目前時間的關鍵字不是函數呼叫，授權回呼看不到，只能從 SQL 文字判斷
+_TIME_KEYWORDS = {"current_timestamp", "current_date", "current_time"}
+
+# SQL 詞元：字串常值、加引號的識別字、註解、名稱或數字，以及單一符號
+_TOKEN = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]"
+    r"|--[^\n]*|/\*.*?(?:\*/|$)|\w+(?:\.\w+)?|\S",
+    re.DOTALL,
+)
+
+
+def _sql_tokens(query):
+    return [
+        token for token in _TOKEN.findall(query) if not token.startswith(("--", "/*"))
+    ]
+
+
+def _is_constant(argument):
+    # 單一數字（可帶正負號）或不含 'now' 的字串常值
+    if argument[:1] in (["+"], ["-"]):
+        argument = argument[1:]
+    if len(argument) != 1:
+        return False
+    token = argument[0]
+    if token.startswith("'"):
+        return "now" not in token.lower()
+    return token[0].isdigit() or token[0] == "."
+
+
+def _stable_time_calls(tokens):
+    """
+    Returns the date/time functions whose every call in the statement is stable.
+
+    A call is stable when its time value is given and every argument is a
+    constant other than 'now'. Without a time value SQLite uses the current
+    time, and a column or expression may evaluate to 'now' as well.
+    """
+    stable, unstable = set(), set()
+    for position, token in enumerate(tokens):
+        name = token.lower()
+        if name not in _TIME_FUNCTIONS or tokens[position + 1 : position + 2] != ["("]:
+            continue
+        arguments, depth = [[]], 0
+        for inner in tokens[position + 2 :]:
+            if inner == "(":
+                depth += 1
+            elif inner == ")":
+                if depth == 0:
+                    break
+                depth -= 1
+            elif inner == "," and depth == 0:
+                arguments.append([])
+                continue
+            arguments[-1].append(inner)
+        if arguments == [[]]:
+            arguments = []
+        # strftime 的第一個參數是格式，時間值從第二個參數開始
+        required = 2 if name == "strftime" else 1
+        if len(arguments) >= required and all(map(_is_constant, arguments)):
+            stable.add(name)
+        else:
+            unstable.add(name)
+    return stable - unstable
+
+
+def normalize_sql(query):
+    """Collapses whitespace and trailing semicolons so equivalent SQL shares a key"""
+    return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+
+class ReadOnlyTracker:
+    """
+    A SQLite authorizer that records whether a statement is cacheable.
+
+    Install it with connection.set_authorizer before executing. It never denies
+    anything; it only notes any write, DDL, PRAGMA, ATTACH or transaction action
+    and calls to non-deterministic functions seen while the statement is prepared.
+    Date/time functions are only cacheable when every call has constant
+    arguments, which the authorizer cannot see, so the SQL text is tokenized to
+    check them. CURRENT_TIMESTAMP, CURRENT_DATE and CURRENT_TIME are keywords
+    rather than function calls and are detected from the tokens as well.
+    """
+
+    def __init__(self, query):
+        tokens = _sql_tokens(query)
+        self._stable_time_calls = _stable_time_calls(tokens)
+        self.cacheable = not any(token.lower() in _TIME_KEYWORDS for token in tokens)
+
+    def __call__(self, action, arg1, arg2, db_name, trigger):
+        if action not in READ_ONLY_ACTIONS:
+            self.cacheable = False
+        elif action == sqlite3.SQLITE_FUNCTION:
+            name = (arg2 or "").lower()
+            if name in _VOLATILE_FUNCTIONS or (
+                name in _TIME_FUNCTIONS and name not in self._stable_time_calls
+            ):
+                self.cacheable = False
+        return sqlite3.SQLITE_OK
+
+
+def _estimate_size(result):
+    size = 256
+    for row in result.get("data", []):
+        size += 64 + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class ResultCache:
+    """
+    An in-memory LRU cache of read-only query results with a memory budget.
+
+    Keys include the database fingerprint, so replacing the file through a
+    re-upload changes the key and old entries are never served again.
+
+    Attributes:
+        max_bytes (int): Approximate memory budget for cached results.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that had to run the query.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = _estimate_size(result)
+        if size > self.max_bytes // 4:
+            # 單一結果過大，不值得佔用快取
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (result, size)
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def invalidate(self, db_file):
+        """Drop every cached result computed from the given database file"""
+        abs_path = os.path.abspath(db_file)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == abs_path]:
+                self._size -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+)
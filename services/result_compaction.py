@@ -0,0 +1,139 @@
+import math
+import os
+
+import pandas as pd
+
+from services.answer_templates import format_value
+
+# 回答 prompt 中查詢結果可使用的 token 預算
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("SQL_AGENT_ANSWER_TOKEN_BUDGET", "2000"))
+
+# 文字欄位列出的最常見值個數
+TOP_VALUES = 5
+
+# 摘要中優先預留空間的範例筆數
+MIN_SAMPLE_ROWS = 3
+
+
+def estimate_tokens(text):
+    """Rough token count: about four UTF-8 bytes per token for mixed CJK text"""
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def _render_row(values):
+    return " | ".join(format_value(value) for value in values)
+
+
+def summarize_columns(columns, rows):
+    """
+    Computes per-column statistics over a structured result with pandas.
+
+    Numeric columns report count, nulls, min, max and mean; other columns
+    report count, nulls, the lexical min and max, distinct values and the most
+    common values.
+
+    Returns:
+        list: One summary line per column.
+    """
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    lines = []
+    for position, column in enumerate(columns):
+        series = frame.iloc[:, position]
+        non_null = series.dropna()
+        nulls = len(series) - len(non_null)
+        numeric = pd.to_numeric(non_null, errors="coerce")
+        if len(non_null) and numeric.notna().all():
+            lines.append(
+                f"- {column}：數值，{len(non_null):,} 筆（空值 {nulls:,}），"
+                f"最小 {format_value(numeric.min().item())}，"
+                f"最大 {format_value(numeric.max().item())}，"
+                f"平均 {format_value(float(numeric.mean()))}"
+            )
+            continue
+        text = non_null.astype(str)
+        counts = text.value_counts()
+        top = "、".join(
+            f"{value}（{count:,}）" for value, count in counts.head(TOP_VALUES).items()
+        )
+        # 文字欄位以字典序取範圍，ISO 格式的日期也因此能得到正確的起訖
+        value_range = f"範圍 {text.min()} ~ {text.max()}，" if len(text) else ""
+        lines.append(
+            f"- {column}：{len(non_null):,} 筆（空值 {nulls:,}），{value_range}"
+            f"{len(counts):,} 種不同值，最常見：{top or '無'}"
+        )
+    return lines
+
+
+def compact_result(columns, rows, has_more=False, total_count=None, budget=None):
+    """
+    Renders a structured result for the answer prompt within a token budget.
+
+    Results that fit are rendered as a compact pipe-separated table. Larger
+    results are replaced by per-column statistics from summarize_columns plus
+    as many leading rows as still fit, so the prompt size stays bounded however
+    many rows the query returned. The statistics are counted against the
+    budget too: for very wide results the column list is cut short with a
+    marker giving the number of columns left out.
+
+    Args:
+        columns (list): Column names of the result.
+        rows (list): Result rows of the current page.
+        has_more (bool): Whether more rows exist after this page.
+        total_count (int): Total number of rows, when known.
+        budget (int): Token budget, defaults to DEFAULT_TOKEN_BUDGET.
+
+    Returns:
+        tuple: (text, summarized), where summarized is True when the text is a
+        summary rather than the complete result.
+    """
+    budget = DEFAULT_TOKEN_BUDGET if budget is None else budget
+    if not rows:
+        return "查無結果", False
+
+    header_line = " | ".join(map(str, columns))
+    table = "\n".join([header_line] + [_render_row(row) for row in rows])
+    if not has_more and estimate_tokens(table) <= budget:
+        return table, False
+
+    if has_more:
+        total = f"共 {total_count:,} 筆" if total_count else f"超過 {len(rows):,} 筆"
+        scope = f"{total}，以下統計僅涵蓋已取得的前 {len(rows):,} 筆"
+    else:
+        scope = f"共 {len(rows):,} 筆"
+    intro = f"查詢結果筆數過多，以下為摘要（{scope}）。\n欄位統計："
+    remaining = budget - estimate_tokens(intro)
+
+    # 欄位統計先預留表頭與 MIN_SAMPLE_ROWS 筆範例的空間；範例放不進一半預算時
+    # （欄位極多）則不列範例。欄位很多時截斷清單，避免單是統計就超出預算
+    reserve = sum(
+        estimate_tokens(line) + 1
+        for line in [header_line] + [_render_row(row) for row in rows[:MIN_SAMPLE_ROWS]]
+    )
+    stats_budget = remaining - reserve if reserve <= remaining // 2 else remaining
+    stats = summarize_columns(columns, rows)
+    shown_stats = []
+    for position, line in enumerate(stats):
+        marker = f"… 另有 {len(stats) - position:,} 個欄位未列出"
+        cost = estimate_tokens(line) + 1
+        if cost + estimate_tokens(marker) + 1 > stats_budget:
+            shown_stats.append(marker)
+            break
+        shown_stats.append(line)
+        stats_budget -= cost
+    header = intro + "\n" + "\n".join(shown_stats)
+    remaining = budget - estimate_tokens(header)
+
+    # 在剩餘預算內盡量保留前幾筆資料作為範例
+    remaining -= estimate_tokens(header_line) + 1
+    if remaining < 0:
+        return header, True
+    sample = [header_line]
+    for row in rows:
+        line = _render_row(row)
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        sample.append(line)
+        remaining -= cost
+    shown = len(sample) - 1
+    return f"{header}\n前 {shown:,} 筆資料：\n" + "\n".join(sample), True
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from services.connection_pool import read_pool
+
+logger = logging.getLogger(__name__)
+
+
+def database_fingerprint(db_file):
+    """
+    Returns a cheap fingerprint that changes whenever the database file changes.
+
+    Combines the file mtime and size with SQLite's PRAGMA schema_version, which is
+    bumped on every schema change even when the mtime granularity hides the write.
+
+    Args:
+        db_file (str): Filesystem path of the SQLite database.
+
+    Returns:
+        tuple: (mtime_ns, size, schema_version)
+    """
+    stat = os.stat(db_file)
+    with read_pool.connection(db_file) as conn:
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    return (stat.st_mtime_ns, stat.st_size, schema_version)
+
+
+# schema_hash 的結果依 database_fingerprint 快取，同一請求多次呼叫只查詢一次 sqlite_master
+_SCHEMA_HASH_ENTRIES = 64
+_schema_hashes = OrderedDict()
+_schema_hashes_lock = threading.Lock()
+
+
+def schema_hash(db_file):
+    """
+    Returns a content hash of the database schema.
+
+    Unlike database_fingerprint it ignores mtime, data and index changes, so the
+    same schema uploaded twice, or indexed later by index_advisor, hashes
+    identically. The hash is memoized per file and recomputed only when the
+    file's database_fingerprint changes.
+
+    Args:
+        db_file (str): Filesystem path of the SQLite database.
+
+    Returns:
+        str: Hex digest of every non-index CREATE statement in sqlite_master.
+    """
+    key = os.path.abspath(db_file)
+    fingerprint = database_fingerprint(key)
+    with _schema_hashes_lock:
+        entry = _schema_hashes.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            _schema_hashes.move_to_end(key)
+            return entry[1]
+
+    with read_pool.connection(key) as conn:
+        rows = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE type != 'index' ORDER BY type, name"
+        ).fetchall()
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(repr(row).encode("utf-8"))
+    value = digest.hexdigest()[:32]
+
+    with _schema_hashes_lock:
+        _schema_hashes[key] = (fingerprint, value)
+        _schema_hashes.move_to_end(key)
+        while len(_schema_hashes) > _SCHEMA_HASH_ENTRIES:
+            _schema_hashes.popitem(last=False)
+    return value
+
+
+class SchemaCache:
+    """
+    A process-wide cache of the rendered schema text used in the SQL prompt.
+
+    SQLDatabase.get_table_info re-runs CREATE TABLE introspection plus sample-row
+    SELECTs for every table. The rendered text only changes when the database
+    does, so it is cached per file and validated against database_fingerprint.
+    Every agent pointing at the same file shares the same entry.
+
+    Attributes:
+        max_entries (int): Maximum number of rendered schemas kept in memory.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that had to render the schema.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_table_info(self, db_file, database, table_names=None):
+        """
+        Returns the rendered schema text, rendering it only on a cache miss.
+
+        Args:
+            db_file (str): Filesystem path of the SQLite database.
+            database (SQLDatabase): The database used to render on a miss.
+            table_names (list): Optional subset of tables to render.
+
+        Returns:
+            str: The schema text for the {table_info} prompt slot.
+        """
+        fingerprint = database_fingerprint(db_file)
+        key = (
+            os.path.abspath(db_file),
+            tuple(sorted(table_names)) if table_names else None,
+        )
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        logger.info("SchemaCache: rendering schema for %s", key[0])
+        table_info = database.get_table_info(table_names)
+
+        with self._lock:
+            self._entries[key] = (fingerprint, table_info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return table_info
+
+    def invalidate(self, db_file):
+        """Drop every cached schema rendered from the given database file"""
+        abs_path = os.path.abspath(db_file)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == abs_path]:
+                del self._entries[key]
+        with _schema_hashes_lock:
+            _schema_hashes.pop(abs_path, None)
+
+
+schema_cache = SchemaCache()
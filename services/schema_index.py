@@ -0,0 +1,299 @@
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import closing
+
+from services.schema_cache import database_fingerprint
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u9fff]+")
+
+# 每個欄位收集的樣本值數量，用於建立索引
+SAMPLE_SCAN_ROWS = 100
+MAX_VALUES_PER_COLUMN = 20
+MAX_VALUE_LENGTH = 50
+PROMPT_SAMPLE_ROWS = 3
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase ASCII words plus CJK unigrams and bigrams.
+
+    Column names such as "產品名稱" have no separators, so CJK runs are indexed
+    as overlapping character bigrams to match questions like "哪個產品銷量最高".
+    """
+    tokens = []
+    for match in _TOKEN_RE.findall(str(text).lower()):
+        if match[0].isascii():
+            tokens.append(match)
+        else:
+            tokens.extend(match)
+            tokens.extend(match[i : i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+def index_path(db_file):
+    """Returns the path of the side file that stores the schema index"""
+    return f"{db_file}.schema.json"
+
+
+def _truncate(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= MAX_VALUE_LENGTH else text[:MAX_VALUE_LENGTH] + "..."
+
+
+class SchemaIndex:
+    """
+    An offline BM25 index over the tables and columns of a SQLite database.
+
+    Each column is indexed as one document made of its table name, column name
+    and a handful of distinct sample values. At question time the index picks the
+    most relevant columns so the SQL prompt only carries a pruned schema instead
+    of every column of a 1000+ column upload.
+
+    Attributes:
+        tables (dict): Table name -> columns, sample rows and foreign keys.
+        fingerprint (list): database_fingerprint of the file the index was built from.
+    """
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, tables, fingerprint):
+        self.tables = tables
+        self.fingerprint = list(fingerprint)
+        self._build_postings()
+
+    @classmethod
+    def build(cls, db_file):
+        """
+        Builds an index by reading column definitions and sample values.
+
+        Args:
+            db_file (str): Filesystem path of the SQLite database.
+
+        Returns:
+            SchemaIndex: The freshly built index.
+        """
+        tables = {}
+        with closing(
+            sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+        ) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type='table' AND name NOT LIKE 'sqlite_%';"
+            )
+            for (table_name,) in cursor.fetchall():
+                cursor.execute(f'PRAGMA table_info("{table_name}");')
+                columns = [[row[1], row[2] or ""] for row in cursor.fetchall()]
+
+                cursor.execute(f'PRAGMA foreign_key_list("{table_name}");')
+                foreign_keys = [[row[3], row[2], row[4]] for row in cursor.fetchall()]
+
+                cursor.execute(
+                    f'SELECT * FROM "{table_name}" LIMIT {SAMPLE_SCAN_ROWS};'
+                )
+                rows = cursor.fetchall()
+
+                values = {}
+                for i, (column_name, _) in enumerate(columns):
+                    distinct = []
+                    for row in rows:
+                        value = _truncate(row[i])
+                        if value is not None and value not in distinct:
+                            distinct.append(value)
+                            if len(distinct) >= MAX_VALUES_PER_COLUMN:
+                                break
+                    values[column_name] = distinct
+
+                tables[table_name] = {
+                    "columns": columns,
+                    "foreign_keys": foreign_keys,
+                    "samples": [
+                        [_truncate(v) for v in row] for row in rows[:PROMPT_SAMPLE_ROWS]
+                    ],
+                    "values": values,
+                }
+
+        return cls(tables, database_fingerprint(db_file))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"fingerprint": self.fingerprint, "tables": self.tables},
+                f,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["tables"], data["fingerprint"])
+
+    @property
+    def column_count(self):
+        return len(self._docs)
+
+    def _build_postings(self):
+        self._docs = []
+        self._term_freqs = []
+        self._doc_freq = Counter()
+        for table_name, table in self.tables.items():
+            table_tokens = tokenize(table_name)
+            for column_name, _ in table["columns"]:
+                tokens = table_tokens + tokenize(column_name) * 2
+                for value in table["values"].get(column_name, []):
+                    if isinstance(value, str):
+                        tokens.extend(tokenize(value))
+                term_freq = Counter(tokens)
+                self._docs.append((table_name, column_name, len(tokens)))
+                self._term_freqs.append(term_freq)
+                self._doc_freq.update(term_freq.keys())
+        total = sum(length for _, _, length in self._docs)
+        self._avg_len = total / len(self._docs) if self._docs else 0.0
+
+    def score(self, question):
+        """Returns the BM25 score of every indexed column for the question"""
+        query_terms = set(tokenize(question))
+        n_docs = len(self._docs)
+        scores = []
+        for (_, _, length), term_freq in zip(self._docs, self._term_freqs):
+            score = 0.0
+            for term in query_terms:
+                tf = term_freq.get(term)
+                if not tf:
+                    continue
+                df = self._doc_freq[term]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * length / self._avg_len)
+                score += idf * tf * (self.k1 + 1) / norm
+            scores.append(score)
+        return scores
+
+    def select(self, question, max_columns):
+        """
+        Picks the most relevant columns for a question.
+
+        The first column of every selected table is always kept, because CSV
+        shard tables (_part_N) start with their shared _row_id join key.
+
+        Args:
+            question (str): The user's question.
+            max_columns (int): Pruning budget, the number of ranked columns kept.
+
+        Returns:
+            dict: Table name -> list of selected column names, in schema order.
+        """
+        scores = self.score(question)
+        ranked = sorted(range(len(self._docs)), key=lambda i: (-scores[i], i))
+        chosen = set(ranked[:max_columns])
+
+        selected = {}
+        for i, (table_name, column_name, _) in enumerate(self._docs):
+            if i in chosen:
+                selected.setdefault(table_name, set()).add(column_name)
+
+        result = {}
+        for table_name, table in self.tables.items():
+            if table_name not in selected:
+                continue
+            names = [name for name, _ in table["columns"]]
+            keep = selected[table_name] | {names[0]}
+            result[table_name] = [name for name in names if name in keep]
+        return result
+
+    def render(self, question, max_columns):
+        """
+        Renders a pruned schema in the same shape as SQLDatabase.get_table_info.
+
+        Args:
+            question (str): The user's question.
+            max_columns (int): Pruning budget, the number of ranked columns kept.
+
+        Returns:
+            str: The schema text for the {table_info} prompt slot.
+        """
+        blocks = []
+        for table_name, column_names in self.select(question, max_columns).items():
+            table = self.tables[table_name]
+            all_names = [name for name, _ in table["columns"]]
+            positions = [all_names.index(name) for name in column_names]
+            types = dict(table["columns"])
+
+            lines = [f'\t"{name}" {types[name]}'.rstrip() for name in column_names]
+            for column, ref_table, ref_column in table["foreign_keys"]:
+                if column in column_names:
+                    lines.append(
+                        f'\tFOREIGN KEY("{column}") '
+                        f'REFERENCES "{ref_table}" ("{ref_column}")'
+                    )
+            block = f'CREATE TABLE "{table_name}" (\n' + ",\n".join(lines) + "\n)"
+
+            omitted = len(all_names) - len(column_names)
+            if omitted:
+                block += f"\n-- 此表另有 {omitted} 個與問題較無關的欄位未列出"
+
+            sample_lines = ["\t".join(column_names)]
+            for row in table["samples"]:
+                sample_lines.append("\t".join(str(row[p]) for p in positions))
+            block += (
+                f"\n\n/*\n{len(table['samples'])} rows from {table_name} table:\n"
+                + "\n".join(sample_lines)
+                + "\n*/"
+            )
+            blocks.append(block)
+        return "\n\n".join(blocks)
+
+
+def build_schema_index(db_file):
+    """Builds the schema index for a database and stores it next to the file"""
+    index = SchemaIndex.build(db_file)
+    index.save(index_path(db_file))
+    logger.info("SchemaIndex: indexed %d columns for %s", index.column_count, db_file)
+    return index
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def load_schema_index(db_file):
+    """
+    Returns the schema index for a database, rebuilding it if it is stale.
+
+    Indexes are normally built at ingestion time; uploaded SQLite files and
+    indexes whose fingerprint no longer matches are (re)built on first use.
+    """
+    abs_path = os.path.abspath(db_file)
+    fingerprint = list(database_fingerprint(abs_path))
+
+    with _loaded_lock:
+        index = _loaded.get(abs_path)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    index = None
+    path = index_path(abs_path)
+    if os.path.exists(path):
+        try:
+            index = SchemaIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("SchemaIndex: failed to load %s: %s", path, e)
+    if index is None or index.fingerprint != fingerprint:
+        index = build_schema_index(abs_path)
+
+    with _loaded_lock:
+        _loaded[abs_path] = index
+    return index
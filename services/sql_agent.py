@@ -1,17 +1,32 @@
-import ast
+import asyncio
 import logging
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
 from langchain_community.utilities import SQLDatabase
+from langchain_core.callbacks import get_usage_metadata_callback
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import START, END, StateGraph
 from langchain_core.output_parsers import StrOutputParser
 
+from services.answer_templates import (
+    ANSWER_MODES,
+    render_answer,
+    resolve_answer_mode,
+)
 from services.choose_state import State, QueryOutput
-from services.prompt import SQLTEMPLATE
+from services.llm_factory import llm_clients
+from services.metrics import metrics
+from services.prompt import SQLREPAIRTEMPLATE, SQLTEMPLATE
+from services.query_cache import nl2sql_cache
+from services.result_compaction import compact_result
+from services.schema_cache import schema_cache, schema_hash
+from services.schema_index import load_schema_index
+from services.sql_executor import execute_sql, validate_select
 
 load_dotenv()
 
@@ -19,6 +34,30 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Schema 剪枝預算：欄位總數超過此值時，只把最相關的欄位放進 prompt（0 代表停用）
+DEFAULT_SCHEMA_BUDGET = int(os.environ.get("SQL_AGENT_SCHEMA_BUDGET", "60"))
+
+# 回答依據結果摘要產生時附加的說明
+SUMMARY_NOTE = "\n\n※ 查詢結果筆數較多，此回答依據結果摘要（欄位統計與部分資料）產生。"
+
+# LLM 回報的 token 用量欄位與 /metrics 中的 kind 標籤
+_TOKEN_FIELDS = (("prompt", "input_tokens"), ("completion", "output_tokens"))
+
+# SQL 未通過執行前驗證時，帶著錯誤訊息重新產生的次數上限
+DEFAULT_REPAIR_ATTEMPTS = int(os.environ.get("SQL_AGENT_REPAIR_ATTEMPTS", "2"))
+
+# 非同步路徑中執行 SQLite 工作的執行緒池，LLM 等待期間不佔用執行緒
+SQL_THREAD_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SQL_AGENT_SQL_THREADS", "8")),
+    thread_name_prefix="agent-sql",
+)
+
+
+async def run_in_sql_pool(func, *args):
+    """Runs a blocking SQLite call on SQL_THREAD_POOL from a coroutine"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(SQL_THREAD_POOL, func, *args)
+
 
 class SQLAgent:
     """
@@ -34,47 +73,59 @@ class SQLAgent:
         top_k (int): The number of results to return from the database.
         database (SQLDatabase): An instance of the SQLDatabase class,
         used to interact with the database.
-        llm (ChatOpenAI): An instance of the ChatOpenAI class,
+        db_file (str): Filesystem path of the database, used as the schema cache key.
+        schema_budget (int): Maximum number of columns put in the SQL prompt for wide
+        databases; 0 always sends the full schema.
+        answer_mode (str): Default answer mode, "fast", "auto" or "llm"; see
+        template_answer.
+        max_repair_attempts (int): Regenerations allowed when validate_query
+        rejects the generated SQL.
+        llm (BaseChatModel): The LLM client shared per model type and credential,
         used to generate SQL queries and answers.
         query_prompt_template (PromptTemplate): A prompt template for generating SQL queries.
+        graph (CompiledStateGraph): The compiled workflow shared by run and arun.
 
     Methods:
         clean_sql_string(sql_string: str) -> str: Cleans and formats a SQL string by
         removing unnecessary characters and whitespace.
-        is_list_string(s: str) -> bool: Checks if a string is syntactically a Python list.
+        get_table_info(question: str) -> str: Returns the (possibly pruned) schema text.
         write_query(state: dict) -> dict: Generates a SQL query from the given state (question).
-        execute_query(state: dict) -> dict: Executes the SQL query and returns the result.
+        validate_query(state: dict) -> dict: Compiles the SQL locally before it runs.
+        execute_query(state: dict) -> dict: Executes the SQL query once and returns
+        the structured result (columns, rows, row_count, elapsed_ms).
         generate_answer(state: dict) -> dict: Generates a natural language answer
         from the SQL query results.
+        build_graph() -> CompiledStateGraph: Compiles the workflow once per agent.
         run(question: str) -> dict: Executes the workflow to answer a question using SQL.
+        arun(question: str) -> dict: Async version of run on the same compiled graph.
+        stream(question: str) -> Iterator[tuple]: Yields each stage as it completes.
     """
 
-    def __init__(self, db_path, top_k=5, api_key=None, model_type="openai"):
+    def __init__(
+        self,
+        db_path,
+        top_k=5,
+        api_key=None,
+        model_type="openai",
+        schema_budget=DEFAULT_SCHEMA_BUDGET,
+        answer_mode=None,
+        max_repair_attempts=DEFAULT_REPAIR_ATTEMPTS,
+    ):
         logger.info("Initializing SQLAgent with database path: %s", db_path)
         self.db_path = db_path
         self.top_k = top_k
+        self.schema_budget = schema_budget
+        self.answer_mode = resolve_answer_mode(answer_mode)
+        self.max_repair_attempts = max_repair_attempts
         self.database = SQLDatabase.from_uri(db_path)
+        self.db_file = self.database._engine.url.database
         self.model_type = model_type
 
-        # 根據模型類型和 API Key 設置 LLM
-        if api_key:
-            if model_type == "gemini":
-                self.llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.5-flash", temperature=0.2, google_api_key=api_key
-                )
-            else:  # default to openai
-                self.llm = ChatOpenAI(
-                    model="gpt-4.1-nano", temperature=0.2, api_key=api_key
-                )
-        else:
-            if model_type == "gemini":
-                self.llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.5-flash", temperature=0.2
-                )
-            else:  # default to openai
-                self.llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0.2)
+        # API Key 只透過參數傳給 LLM 客戶端，不寫入共用的環境變數
+        self.llm = llm_clients.get(model_type, api_key)
 
         self.query_prompt_template = PromptTemplate.from_template(SQLTEMPLATE)
+        self.graph = self.build_graph()
 
     def clean_sql_string(self, sql_string):
         """Clean and format SQL string"""
@@ -83,110 +134,551 @@ class SQLAgent:
         sql_string = re.sub(r"\s+", " ", sql_string)
         return sql_string.strip()
 
-    def is_list_string(self, s):
-        """Check if a string is syntactically a Python list"""
-        try:
-            node = ast.parse(s, mode="eval")
-            return isinstance(node.body, ast.List)
-        except SyntaxError:
-            return False
+    def get_table_info(self, question):
+        """Return schema text for the prompt, pruned to the most relevant columns"""
+        if self.schema_budget:
+            try:
+                index = load_schema_index(self.db_file)
+                if index.column_count > self.schema_budget:
+                    return index.render(question, self.schema_budget)
+            except Exception as e:
+                logger.warning("Schema pruning failed, using full schema: %s", e)
+        return schema_cache.get_table_info(self.db_file, self.database)
+
+    def _cached_query(self, state):
+        """Looks up the NL2SQL cache, returning (cached query or None, cache key)"""
+        if state.get("validation_error"):
+            # 修正上一次的 SQL 時不查快取，但沿用快取鍵以便存下修正後的查詢
+            return None, state.get("cache_key")
+        if state.get("bypass_cache"):
+            return None, None
+        cache_key = nl2sql_cache.make_key(
+            state["question"], schema_hash(self.db_file), self.model_type
+        )
+        cached_query = nl2sql_cache.get(cache_key)
+        metrics.inc(
+            "sql_cache_requests_total",
+            cache="nl2sql",
+            outcome="hit" if cached_query else "miss",
+        )
+        return cached_query, cache_key
+
+    def _query_prompt(self, state):
+        with metrics.timer("sql_agent_schema_render_seconds"):
+            table_info = self.get_table_info(state["question"])
+        prompt = self.query_prompt_template.invoke(
+            {
+                "dialect": self.database.dialect,
+                "top_k": 25,
+                "table_info": table_info,
+                "input": state["question"],
+            }
+        )
+        if not state.get("validation_error"):
+            return prompt
+        # 重新產生時附上被拒絕的 SQL 與錯誤訊息，讓 LLM 針對錯誤修正
+        return prompt.to_string() + SQLREPAIRTEMPLATE.format(
+            query=state["query"], error=state["validation_error"]
+        )
+
+    def _query_update(self, result, cache_key):
+        logger.info("Generated SQL Query: %s", result)
+        if result is None:
+            return {"query": "查無結果", "cache_hit": False}
+
+        cleaned_query = self.clean_sql_string(result["query"])
+        return {"query": cleaned_query, "cache_hit": False, "cache_key": cache_key}
+
+    @contextmanager
+    def _llm_call(self, call):
+        """Times an LLM call and counts the tokens it reports"""
+        with metrics.timer(
+            "sql_agent_llm_seconds", call=call, model_type=self.model_type
+        ), get_usage_metadata_callback() as usage:
+            yield
+        for counts in usage.usage_metadata.values():
+            for kind, field in _TOKEN_FIELDS:
+                metrics.inc(
+                    "sql_agent_llm_tokens_total",
+                    counts.get(field, 0),
+                    call=call,
+                    model_type=self.model_type,
+                    kind=kind,
+                )
 
     def write_query(self, state):
         """Generate SQL query from state"""
         logger.info("WRITE QUERY")
         try:
-            prompt = self.query_prompt_template.invoke(
-                {
-                    "dialect": self.database.dialect,
-                    "top_k": 25,
-                    "table_info": self.database.get_table_info(),
-                    "input": state["question"],
-                }
-            )
+            cached_query, cache_key = self._cached_query(state)
+            if cached_query:
+                logger.info("NL2SQL cache hit: %s", cached_query)
+                return {"query": cached_query, "cache_hit": True}
 
+            prompt = self._query_prompt(state)
             structured_llm = self.llm.with_structured_output(QueryOutput)
-            result = structured_llm.invoke(prompt)
-            logger.info("Generated SQL Query: %s", result)
+            with self._llm_call("write_query"):
+                result = structured_llm.invoke(prompt)
+            return self._query_update(result, cache_key)
+
+        except Exception as e:
+            logger.error("Error generating query: %s", e)
+            return {"query": "查無結果", "cache_hit": False}
 
-            if result is None:
-                return {"query": "查無結果"}
+    async def awrite_query(self, state):
+        """Async write_query: awaits the LLM instead of blocking a thread on it"""
+        logger.info("WRITE QUERY")
+        try:
+            # 快取查詢與 schema 渲染會讀取 SQLite，交給執行緒池避免阻塞事件迴圈
+            cached_query, cache_key = await run_in_sql_pool(self._cached_query, state)
+            if cached_query:
+                logger.info("NL2SQL cache hit: %s", cached_query)
+                return {"query": cached_query, "cache_hit": True}
 
-            cleaned_query = self.clean_sql_string(result["query"])
-            return {"query": cleaned_query}
+            prompt = await run_in_sql_pool(self._query_prompt, state)
+            structured_llm = self.llm.with_structured_output(QueryOutput)
+            with self._llm_call("write_query"):
+                result = await structured_llm.ainvoke(prompt)
+            return self._query_update(result, cache_key)
 
         except Exception as e:
             logger.error("Error generating query: %s", e)
-            return {"query": "查無結果"}
+            return {"query": "查無結果", "cache_hit": False}
+
+    def validate_query(self, state):
+        """
+        Compiles the generated SQL against the schema before it is executed.
+
+        Unknown tables, columns or functions, syntax errors and anything but a
+        single SELECT are caught here without scanning any rows. A rejected
+        query is sent back to write_query with the error message, at most
+        max_repair_attempts times; after that the question ends with an
+        "invalid_sql" error instead of an empty result.
+        """
+        logger.info("VALIDATE QUERY")
+        if state["query"] == "查無結果":
+            return {"validation_error": None}
+
+        error = validate_select(self.db_file, state["query"])
+        if error is None:
+            return {"validation_error": None}
+
+        attempts = state.get("repair_attempts") or 0
+        logger.warning("SQL validation failed (attempt %d): %s", attempts + 1, error)
+        if attempts >= self.max_repair_attempts:
+            return {
+                "validation_error": error,
+                "error": {
+                    "success": False,
+                    "error": f"無法產生有效的 SQL 查詢：{error}",
+                    "error_type": "invalid_sql",
+                    "query_id": state.get("query_id"),
+                },
+            }
+        return {"validation_error": error, "repair_attempts": attempts + 1}
+
+    async def avalidate_query(self, state):
+        """Async validate_query: compiles the SQL in the SQL pool"""
+        return await run_in_sql_pool(self.validate_query, state)
+
+    @staticmethod
+    def route_after_validation(state):
+        """Picks the node that follows validate_query"""
+        if state.get("error"):
+            return "generate_answer"
+        if state.get("validation_error"):
+            return "write_query"
+        return "execute_query"
 
     def execute_query(self, state):
         """Execute SQL query"""
         logger.info("EXECUTE QUERY")
+        empty = {
+            "result": "查無結果",
+            "columns": [],
+            "rows": [],
+            "row_count": 0,
+            "has_more": False,
+            "next_cursor": None,
+            "total_count": 0,
+            "elapsed_ms": 0.0,
+        }
+
+        if state["query"] == "查無結果":
+            return empty
+
+        outcome = execute_sql(
+            self.db_file,
+            state["query"],
+            page_size=state.get("page_size"),
+            query_id=state.get("query_id"),
+        )
+        if not outcome["success"]:
+            if outcome.get("error_type"):
+                # 超過執行預算或被取消，回報結構化錯誤而不是當作查無結果
+                return dict(empty, error=outcome)
+            # 一般 SQL 錯誤仍交給 LLM 作答，但不可套用「查無資料」的範本
+            return dict(empty, sql_error=outcome["error"])
+
+        logger.info(
+            "SQL Result: %d rows in %.2f ms",
+            outcome["row_count"],
+            outcome["elapsed_ms"],
+        )
+
+        # 只快取實際執行成功的 SQL，避免把錯誤的查詢存起來
+        if state.get("cache_key") and not state.get("cache_hit"):
+            nl2sql_cache.put(
+                state["cache_key"],
+                state["question"],
+                schema_hash(self.db_file),
+                self.model_type,
+                state["query"],
+            )
 
-        try:
-            execute_query_tool = QuerySQLDatabaseTool(db=self.database)
-            result = execute_query_tool.invoke(state["query"])
-
-            logger.info("SQL Result: %s", result)
-
-            if not self.is_list_string(result):
-                return {"result": "查無結果"}
+        rows = outcome["data"]
+        return {
+            "result": str(rows) if rows else "查無結果",
+            "columns": outcome["columns"],
+            "rows": rows,
+            "row_count": outcome["row_count"],
+            "has_more": outcome["has_more"],
+            "next_cursor": outcome["next_cursor"],
+            "total_count": outcome["total_count"],
+            "elapsed_ms": outcome["elapsed_ms"],
+        }
+
+    async def aexecute_query(self, state):
+        """Async execute_query: runs the blocking SQLite work in the SQL pool"""
+        return await run_in_sql_pool(self.execute_query, state)
+
+    def _answer_prompt(self, state):
+        prompt = """
+        你是一個 SQL 專家，擅長從 SQL 查詢和結果中生成答案。
+        根據以下的使用者問題、對應的 SQL 查詢和 SQL 結果，回答使用者的問題。
+        使用者問題：{{question}}
+        SQL 查詢語法：{{query}}
+        SQL 查詢結果：{{result}}
+
+        不需要提供 SQL 查詢的語法，只需根據 SQL 查詢結果提供答案。
+        注意：請使用繁體中文作答，並在回答前仔細思考，清楚表達你的分析過程與理由，避免直接給出簡單的答案，要求有深度的回答，並避免使用不雅詞彙。
+        """
+        # 依 token 預算壓縮查詢結果，筆數過多時改用欄位統計摘要與部分資料
+        result, summarized = compact_result(
+            state.get("columns") or [],
+            state.get("rows") or [],
+            has_more=state.get("has_more", False),
+            total_count=state.get("total_count"),
+        )
+        if summarized:
+            prompt += "請根據上述摘要作答，不要臆測摘要以外的個別資料。\n"
+        prompt = (
+            prompt.replace("{{question}}", state["question"])
+            .replace("{{query}}", state["query"])
+            .replace("{{result}}", result)
+        )
+        return prompt, summarized
+
+    @staticmethod
+    def _answer_update(response, summarized):
+        if summarized:
+            response += SUMMARY_NOTE
+        return {
+            "generation": response,
+            "answer_source": "llm",
+            "answer_from_summary": summarized,
+        }
+
+    def template_answer(self, state):
+        """
+        Renders the answer locally when the answer mode allows it.
 
-            return {"result": result}
+        "fast" always answers from a template, "auto" only for small and simple
+        result shapes (a scalar, one row, a short one- or two-column list) and
+        "llm" always asks the model, which is the slowest stage of the workflow.
+        Templates are only used when a SQL statement was generated and ran
+        successfully; otherwise an empty result would read as "no matching data".
 
-        except Exception as e:
-            logger.error("Error executing query: %s", e)
-            return {"result": "查無結果"}
+        Returns:
+            str: The templated answer, or None when the LLM should answer.
+        """
+        mode = state.get("answer_mode")
+        if mode not in ANSWER_MODES:
+            mode = self.answer_mode
+        if mode == "llm":
+            return None
+        if state["query"] == "查無結果" or state.get("sql_error"):
+            return None
+        return render_answer(
+            state.get("columns") or [],
+            state.get("rows") or [],
+            has_more=state.get("has_more", False),
+            total_count=state.get("total_count"),
+            simple_only=mode == "auto",
+        )
 
     def generate_answer(self, state):
         """Generate answer from SQL results"""
         logger.info("GENERATE ANSWER")
+        if state.get("error"):
+            return {"generation": state["error"]["error"], "answer_source": "error"}
+        answer = self.template_answer(state)
+        if answer is not None:
+            return {"generation": answer, "answer_source": "template"}
         try:
-            prompt = """
-            你是一個 SQL 專家，擅長從 SQL 查詢和結果中生成答案。
-            根據以下的使用者問題、對應的 SQL 查詢和 SQL 結果，回答使用者的問題。
-            使用者問題：{{question}}
-            SQL 查詢語法：{{query}}
-            SQL 查詢結果：{{result}}
-
-            不需要提供 SQL 查詢的語法，只需根據 SQL 查詢結果提供答案。
-            注意：請使用繁體中文作答，並在回答前仔細思考，清楚表達你的分析過程與理由，避免直接給出簡單的答案，要求有深度的回答，並避免使用不雅詞彙。
-            """
-            prompt = (
-                prompt.replace("{{question}}", state["question"])
-                .replace("{{query}}", state["query"])
-                .replace("{{result}}", state["result"])
-            )
+            prompt, summarized = self._answer_prompt(state)
+            sql_output_chain = self.llm | StrOutputParser()
+            with self._llm_call("generate_answer"):
+                response = sql_output_chain.invoke(prompt)
+            return self._answer_update(response, summarized)
 
+        except Exception as e:
+            logger.error("Error generating answer: %s", e)
+            return {
+                "generation": "抱歉，生成答案時發生錯誤。",
+                "answer_source": "error",
+            }
+
+    async def agenerate_answer(self, state):
+        """Async generate_answer: awaits the LLM instead of blocking a thread on it"""
+        logger.info("GENERATE ANSWER")
+        if state.get("error"):
+            return {"generation": state["error"]["error"], "answer_source": "error"}
+        answer = self.template_answer(state)
+        if answer is not None:
+            return {"generation": answer, "answer_source": "template"}
+        try:
+            # 摘要計算使用 pandas，交給執行緒池避免阻塞事件迴圈
+            prompt, summarized = await run_in_sql_pool(self._answer_prompt, state)
             sql_output_chain = self.llm | StrOutputParser()
-            response = sql_output_chain.invoke(prompt)
-            return {"generation": response}
+            with self._llm_call("generate_answer"):
+                response = await sql_output_chain.ainvoke(prompt)
+            return self._answer_update(response, summarized)
 
         except Exception as e:
             logger.error("Error generating answer: %s", e)
-            return {"generation": "抱歉，生成答案時發生錯誤。"}
+            return {
+                "generation": "抱歉，生成答案時發生錯誤。",
+                "answer_source": "error",
+            }
+
+    @staticmethod
+    def _record_update(node, update):
+        if node == "validate_query" and update.get("validation_error"):
+            metrics.inc("sql_agent_validation_failures_total")
+        elif node == "execute_query" and not update.get("error"):
+            metrics.observe("sql_agent_result_rows", update.get("row_count", 0))
+        elif node == "generate_answer":
+            metrics.inc("sql_agent_answers_total", source=update.get("answer_source"))
+        return update
+
+    def _timed_node(self, node, func, afunc):
+        """Wraps a node's sync and async functions with per-node metrics"""
+
+        def run_node(state):
+            with metrics.timer("sql_agent_node_seconds", node=node):
+                update = func(state)
+            return self._record_update(node, update)
+
+        async def arun_node(state):
+            with metrics.timer("sql_agent_node_seconds", node=node):
+                update = await afunc(state)
+            return self._record_update(node, update)
+
+        return RunnableLambda(run_node, afunc=arun_node)
+
+    def build_graph(self):
+        """
+        Builds and compiles the LangGraph workflow for this agent.
 
-    def run(self, question):
+        The compiled graph holds no per-question state, so it is built once in
+        the constructor and shared by every call to run/arun.
+
+        Returns:
+            CompiledStateGraph: The compiled write -> validate -> execute -> answer
+            workflow, looping back to write when validation fails.
+        """
+        workflow = StateGraph(State)
+        # 每個節點同時提供同步與非同步版本，invoke/stream 與 ainvoke 共用同一張圖，
+        # 並記錄各節點耗時供 /metrics 使用
+        workflow.add_node(
+            "write_query",
+            self._timed_node("write_query", self.write_query, self.awrite_query),
+        )
+        workflow.add_node(
+            "validate_query",
+            self._timed_node(
+                "validate_query", self.validate_query, self.avalidate_query
+            ),
+        )
+        workflow.add_node(
+            "execute_query",
+            self._timed_node("execute_query", self.execute_query, self.aexecute_query),
+        )
+        workflow.add_node(
+            "generate_answer",
+            self._timed_node(
+                "generate_answer", self.generate_answer, self.agenerate_answer
+            ),
+        )
+
+        workflow.add_edge(START, "write_query")
+        workflow.add_edge("write_query", "validate_query")
+        # 驗證失敗時回到 write_query 修正，超過次數上限則直接回報錯誤
+        workflow.add_conditional_edges(
+            "validate_query",
+            self.route_after_validation,
+            ["write_query", "execute_query", "generate_answer"],
+        )
+        workflow.add_edge("execute_query", "generate_answer")
+        workflow.add_edge("generate_answer", END)
+
+        return workflow.compile()
+
+    @staticmethod
+    def _inputs(question, page_size, bypass_cache, query_id, answer_mode):
+        return {
+            "question": question,
+            "page_size": page_size,
+            "bypass_cache": bypass_cache,
+            "query_id": query_id,
+            "answer_mode": answer_mode,
+        }
+
+    def run(
+        self,
+        question,
+        page_size=None,
+        bypass_cache=False,
+        query_id=None,
+        answer_mode=None,
+    ):
         """
         Executes a workflow to answer a question using SQL.
 
         The workflow consists of writing a SQL query, executing it, and generating an answer based on the results.
+        The call is reentrant: concurrent questions share the same compiled graph.
 
         Args:
             question (str): The question to answer.
+            page_size (int): Maximum number of result rows kept in the output;
+            further pages can be fetched with the returned next_cursor.
+            bypass_cache (bool): Skip the NL2SQL cache and always ask the LLM.
+            query_id (str): Id that /api/cancel_query can use to stop the SQL.
+            answer_mode (str): "fast", "auto" or "llm", overriding the agent's
+            default for this question.
 
         Returns:
             dict: A dictionary containing the final output of the workflow.
         """
-        workflow = StateGraph(State)
-        workflow.add_node("write_query", self.write_query)  # write query
-        workflow.add_node("execute_query", self.execute_query)  # execute query
-        workflow.add_node("generate_answer", self.generate_answer)  # generate answer
+        return self.graph.invoke(
+            self._inputs(question, page_size, bypass_cache, query_id, answer_mode)
+        )
+
+    async def arun(
+        self,
+        question,
+        page_size=None,
+        bypass_cache=False,
+        query_id=None,
+        answer_mode=None,
+    ):
+        """
+        Asynchronous counterpart of run, sharing the same compiled graph.
 
-        workflow.add_edge(START, "write_query")
-        workflow.add_edge("write_query", "execute_query")
-        workflow.add_edge("execute_query", "generate_answer")
-        workflow.add_edge("generate_answer", END)
+        Both LLM calls are awaited with ainvoke and the SQLite work runs on
+        SQL_THREAD_POOL, so a single event loop can keep many questions in
+        flight while they wait on the model.
+
+        Args:
+            question (str): The question to answer.
+            page_size (int): Maximum number of result rows kept in the output.
+            bypass_cache (bool): Skip the NL2SQL cache and always ask the LLM.
+            query_id (str): Id that /api/cancel_query can use to stop the SQL.
+            answer_mode (str): "fast", "auto" or "llm", overriding the agent's
+            default for this question.
+
+        Returns:
+            dict: A dictionary containing the final output of the workflow.
+        """
+        return await self.graph.ainvoke(
+            self._inputs(question, page_size, bypass_cache, query_id, answer_mode)
+        )
+
+    def stream(
+        self,
+        question,
+        page_size=None,
+        bypass_cache=False,
+        query_id=None,
+        answer_mode=None,
+    ):
+        """
+        Executes the workflow and yields each stage as soon as it completes.
 
-        compiled_app = workflow.compile()
-        output = compiled_app.invoke({"question": question})
-        return output
+        Uses LangGraph's "updates" stream for node outputs and its "messages" stream
+        for the answer tokens, so callers can show the SQL and the result table
+        long before the answer prose is finished.
+
+        Args:
+            question (str): The question to answer.
+            page_size (int): Maximum number of result rows kept in the output.
+            bypass_cache (bool): Skip the NL2SQL cache and always ask the LLM.
+            query_id (str): Id that /api/cancel_query can use to stop the SQL.
+            answer_mode (str): "fast", "auto" or "llm", overriding the agent's
+            default for this question.
+
+        Yields:
+            tuple: (event, payload) where event is "sql", "result", "token" or "answer".
+        """
+        inputs = self._inputs(question, page_size, bypass_cache, query_id, answer_mode)
+        for mode, chunk in self.graph.stream(
+            inputs, stream_mode=["updates", "messages"]
+        ):
+            if mode == "messages":
+                message, metadata = chunk
+                if metadata.get("langgraph_node") == "generate_answer" and isinstance(
+                    message.content, str
+                ):
+                    if message.content:
+                        yield "token", {"text": message.content}
+                continue
+
+            for node, values in chunk.items():
+                if node == "write_query":
+                    yield "sql", {
+                        "generated_sql": values.get("query", ""),
+                        "cache_hit": values.get("cache_hit", False),
+                    }
+                elif node == "validate_query":
+                    if values.get("error"):
+                        # SQL 未通過驗證且無法修正，不會執行，直接回報錯誤
+                        yield "result", {
+                            "sql_result": "查無結果",
+                            "columns": [],
+                            "data": [],
+                            "row_count": 0,
+                            "has_more": False,
+                            "next_cursor": None,
+                            "total_count": 0,
+                            "elapsed_ms": 0.0,
+                            "execution_error": values["error"],
+                        }
+                elif node == "execute_query":
+                    yield "result", {
+                        "sql_result": values.get("result", ""),
+                        "columns": values.get("columns", []),
+                        "data": values.get("rows", []),
+                        "row_count": values.get("row_count", 0),
+                        "has_more": values.get("has_more", False),
+                        "next_cursor": values.get("next_cursor"),
+                        "total_count": values.get("total_count"),
+                        "elapsed_ms": values.get("elapsed_ms", 0.0),
+                        "execution_error": values.get("error"),
+                    }
+                elif node == "generate_answer":
+                    yield "answer", {
+                        "generation": values.get("generation", ""),
+                        "answer_source": values.get("answer_source"),
+                        "answer_from_summary": values.get("answer_from_summary", False),
+                    }
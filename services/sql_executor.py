@@ -0,0 +1,275 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from services.connection_pool import read_pool
+from services.index_advisor import index_advisor
+from services.metrics import metrics
+from services.query_budget import DEFAULT_MAX_ROWS, QueryBudget
+from services.result_cache import (
+    READ_ONLY_ACTIONS,
+    ReadOnlyTracker,
+    normalize_sql,
+    result_cache,
+)
+from services.schema_cache import database_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 每頁預設與最大筆數，確保伺服器端記憶體有上限
+DEFAULT_PAGE_SIZE = int(os.environ.get("SQL_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = int(os.environ.get("SQL_MAX_PAGE_SIZE", "5000"))
+SKIP_BATCH_SIZE = 1000
+
+
+def _query_digest(query):
+    return hashlib.sha1(normalize_sql(query).encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(query, offset):
+    """Encodes an opaque page token bound to the query text"""
+    payload = json.dumps({"q": _query_digest(query), "o": offset})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(query, cursor):
+    """
+    Decodes a page token produced by encode_cursor.
+
+    Raises:
+        ValueError: If the token is malformed or was issued for another query.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        offset = int(payload["o"])
+        digest = payload["q"]
+    except Exception:
+        raise ValueError("無效的分頁游標")
+    if digest != _query_digest(query) or offset < 0:
+        raise ValueError("分頁游標與查詢不符")
+    return offset
+
+
+def is_select_statement(query):
+    """Returns True for statements that can be wrapped in a subquery"""
+    head = query.lstrip().split(None, 1)
+    return bool(head) and head[0].upper() in ("SELECT", "WITH", "VALUES")
+
+
+def count_rows(conn, query):
+    """Counts the rows a SELECT returns without materializing them"""
+    if not is_select_statement(query):
+        return None
+    try:
+        stripped = query.strip().rstrip(";")
+        return conn.execute(f"SELECT COUNT(*) FROM ({stripped})").fetchone()[0]
+    except sqlite3.Error as e:
+        logger.warning("Failed to count rows: %s", e)
+        return None
+
+
+class _SelectOnlyGuard:
+    """An authorizer that denies every action a plain SELECT does not need"""
+
+    def __init__(self):
+        self.denied = None
+
+    def __call__(self, action, arg1, arg2, db_name, trigger):
+        if action in READ_ONLY_ACTIONS:
+            return sqlite3.SQLITE_OK
+        self.denied = self.denied or action
+        return sqlite3.SQLITE_DENY
+
+
+def validate_select(db_file, query):
+    """
+    Checks a generated statement against the schema without running it.
+
+    The statement is compiled with EXPLAIN on a pooled read-only connection,
+    which resolves every table, column and function name but reads no rows.
+    An authorizer rejects anything but a single read-only SELECT.
+
+    Returns:
+        str: SQLite's error message when the statement is invalid, else None.
+    """
+    if not query or not query.strip():
+        return "empty statement"
+    if not is_select_statement(query):
+        return "only a single SELECT statement is allowed"
+
+    guard = _SelectOnlyGuard()
+    with read_pool.connection(db_file) as conn:
+        db_cursor = conn.cursor()
+        try:
+            conn.set_authorizer(guard)
+            try:
+                db_cursor.execute(f"EXPLAIN {query.strip()}")
+            finally:
+                conn.set_authorizer(None)
+        except (sqlite3.Error, sqlite3.Warning) as e:
+            if guard.denied is not None:
+                return "only a single SELECT statement is allowed"
+            return str(e)
+        finally:
+            db_cursor.close()
+    return None
+
+
+def execute_sql(
+    db_file,
+    query,
+    page_size=None,
+    cursor=None,
+    with_total=False,
+    query_id=None,
+    timeout_ms=None,
+    max_vm_steps=None,
+    max_rows=None,
+):
+    """
+    Executes a SQL statement once and returns one bounded page of the result.
+
+    This is the single execution path shared by the /api/sql_query endpoint and
+    the SQLAgent execute node, so the agent's answer and the JSON response are
+    both derived from the same rows. Statements run on a pooled read-only
+    connection, so writes are rejected. Rows are pulled with fetchmany, so memory
+    is bounded by the page size no matter how large the result is. Pages of
+    read-only statements are served from result_cache until the file changes,
+    and executed SELECTs are logged for index_advisor.
+
+    Execution is bounded by a QueryBudget (time and VM steps) and can be
+    cancelled by query_id; paging stops after max_rows rows in total.
+
+    Args:
+        db_file (str): Filesystem path of the SQLite database.
+        query (str): The SQL statement to run.
+        page_size (int): Rows per page, defaults to DEFAULT_PAGE_SIZE.
+        cursor (str): Token from a previous page's next_cursor.
+        with_total (bool): Also compute the total row count.
+        query_id (str): Client-chosen id that cancel_query can interrupt.
+        timeout_ms (int): Time budget, defaults to DEFAULT_TIMEOUT_MS.
+        max_vm_steps (int): VM step budget, defaults to DEFAULT_MAX_VM_STEPS.
+        max_rows (int): Rows readable across all pages, defaults to
+            DEFAULT_MAX_ROWS.
+
+    Returns:
+        dict: {"success", "columns", "data", "row_count", "offset", "page_size",
+        "has_more", "next_cursor", "total_count", "truncated", "elapsed_ms",
+        "cache_hit"} on success, {"success": False, "error"} on failure, with
+        "error_type", "query_id", "vm_steps" and "limits" added when the query
+        exceeded its budget or was cancelled.
+    """
+    start = time.perf_counter()
+    budget = None
+    try:
+        page_size = min(max(int(page_size or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        offset = decode_cursor(query, cursor) if cursor else 0
+        max_rows = DEFAULT_MAX_ROWS if max_rows is None else max_rows
+        if offset >= max_rows:
+            raise ValueError(f"已達單一查詢最多可讀取的 {max_rows} 筆上限")
+        page_size = min(page_size, max_rows - offset)
+
+        cache_key = (
+            os.path.abspath(db_file),
+            database_fingerprint(db_file),
+            normalize_sql(query),
+            offset,
+            page_size,
+            with_total,
+            max_rows,
+        )
+        cached = result_cache.get(cache_key)
+        metrics.inc(
+            "sql_cache_requests_total",
+            cache="result",
+            outcome="miss" if cached is None else "hit",
+        )
+        if cached is not None:
+            # 快取命中不會掃描資料表，不計入索引顧問的查詢紀錄
+            return dict(
+                cached,
+                elapsed_ms=round((time.perf_counter() - start) * 1000, 2),
+                cache_hit=True,
+            )
+
+        budget = QueryBudget(query_id, timeout_ms=timeout_ms, max_vm_steps=max_vm_steps)
+        with read_pool.connection(db_file) as conn, budget.attach(conn):
+            # 透過 authorizer 在 prepare 階段判斷語句是否為只讀
+            tracker = ReadOnlyTracker(query)
+            db_cursor = conn.cursor()
+            try:
+                # 連線會被重複使用，authorizer 必須在任何情況下移除
+                conn.set_authorizer(tracker)
+                try:
+                    db_cursor.execute(query)
+                finally:
+                    conn.set_authorizer(None)
+
+                # 獲取列名
+                columns = (
+                    [description[0] for description in db_cursor.description]
+                    if db_cursor.description
+                    else []
+                )
+
+                # 跳過前面的頁面，逐批讀取避免一次載入
+                remaining = offset
+                while remaining > 0:
+                    skipped = db_cursor.fetchmany(min(remaining, SKIP_BATCH_SIZE))
+                    if not skipped:
+                        break
+                    remaining -= len(skipped)
+
+                # 多讀一筆以判斷是否還有下一頁
+                results = db_cursor.fetchmany(page_size + 1)
+                has_more = len(results) > page_size
+                results = results[:page_size]
+
+                # 超過可讀取筆數上限時不再提供下一頁
+                truncated = has_more and offset + len(results) >= max_rows
+                if truncated:
+                    has_more = False
+
+                total_count = None
+                if not has_more and not truncated:
+                    total_count = offset + len(results)
+                elif with_total:
+                    total_count = count_rows(conn, query)
+            finally:
+                # 提早關閉游標，避免連線歸還後仍佔用讀取交易
+                db_cursor.close()
+
+        result = {
+            "success": True,
+            "columns": columns,
+            "data": results,
+            "row_count": len(results),
+            "offset": offset,
+            "page_size": page_size,
+            "has_more": has_more,
+            "next_cursor": (
+                encode_cursor(query, offset + len(results)) if has_more else None
+            ),
+            "total_count": total_count,
+            "truncated": truncated,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "cache_hit": False,
+        }
+        metrics.observe("sql_execute_seconds", result["elapsed_ms"] / 1000)
+        if tracker.cacheable:
+            result_cache.put(cache_key, result)
+        if is_select_statement(query):
+            # 記錄查詢供索引顧問分析重複的全表掃描
+            index_advisor.record(db_file, query, result["elapsed_ms"])
+        return result
+    except Exception as e:
+        if budget is not None and budget.reason:
+            logger.warning("SQL aborted (%s): %s", budget.reason, query)
+            metrics.inc("sql_aborted_total", reason=budget.reason)
+            return budget.error()
+        logger.warning("Error executing SQL: %s", e)
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,33 @@
+import asyncio
+
+from services.batch_runner import BatchRun
+
+
+class LoopBoundAgent:
+    """Stands in for a SQLAgent whose cached async client is bound to one loop"""
+
+    def __init__(self):
+        self.loop = None
+
+    async def arun(self, question, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        if loop is not self.loop or self.loop.is_closed():
+            raise RuntimeError("Event loop is closed")
+        await asyncio.sleep(0)
+        return {"generation": question}
+
+
+def test_consecutive_batches_share_the_event_loop():
+    agent = LoopBoundAgent()
+    for batch in range(2):
+        questions = [f"問題 {batch}-{index}" for index in range(5)]
+        items = list(BatchRun(agent, questions, concurrency=2).results())
+        assert [item["error"] for item in items] == [None] * 5
+        assert sorted(item["result"]["generation"] for item in items) == questions
+
+
+def test_duplicate_questions_are_answered_once():
+    items = list(BatchRun(LoopBoundAgent(), ["a", "b", "a"]).results())
+    assert sorted(item["positions"] for item in items) == [[0, 2], [1]]
@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+from services.result_cache import ReadOnlyTracker
+from services.sql_executor import execute_sql
+
+
+def is_cacheable(query):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE orders (id INTEGER, placed TEXT)")
+    tracker = ReadOnlyTracker(query)
+    conn.set_authorizer(tracker)
+    try:
+        conn.execute(query).fetchall()
+    finally:
+        conn.close()
+    return tracker.cacheable
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT date()",
+        "SELECT time()",
+        "SELECT datetime()",
+        "SELECT julianday()",
+        "SELECT unixepoch()",
+        "SELECT strftime('%s')",
+        "SELECT date('now')",
+        "SELECT date('NOW', '-1 day')",
+        "SELECT date('2024-01-01'), date()",
+        "SELECT date(placed) FROM orders",
+        "SELECT CURRENT_TIMESTAMP",
+        "SELECT current_date",
+        "SELECT random()",
+    ],
+)
+def test_volatile_statements_are_not_cacheable(query):
+    assert not is_cacheable(query)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT date('2024-01-01')",
+        "SELECT strftime('%Y', '2024-01-01'), julianday(2460000.5)",
+        "SELECT datetime(1700000000, 'unixepoch')",
+        'SELECT \'CURRENT_DATE\', "current_time" FROM (SELECT 1 AS "current_time")',
+        "SELECT id FROM orders",
+    ],
+)
+def test_stable_statements_are_cacheable(query):
+    assert is_cacheable(query)
+
+
+def test_execute_sql_does_not_cache_time_defaults(tmp_path):
+    db_file = str(tmp_path / "time.db")
+    sqlite3.connect(db_file).close()
+    for query in ["SELECT date()", "SELECT strftime('%s')", "SELECT unixepoch()"]:
+        assert execute_sql(db_file, query)["cache_hit"] is False
+        assert execute_sql(db_file, query)["cache_hit"] is False
+    execute_sql(db_file, "SELECT date('2024-01-01')")
+    assert execute_sql(db_file, "SELECT date('2024-01-01')")["cache_hit"] is True